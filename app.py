@@ -1,114 +1,124 @@
 import eel
+import multiprocessing
 import random
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import networks as nets
 from gographs import *
 from time import time
+from server import GameStore
+from book import OpeningBook
 
-eel.init('web')
+# The games are evicted when they have been idle for an hour (or 5 minutes after they ended).
+# The bots remember their moves in the opening in the default book, so that they answer at once in later games.
+games = GameStore(max_games=100,max_nodes=100000,book=OpeningBook.Open())
 
-active_games = {}
-active_bots = {}
-
-def generate_random_key(N=20):
-    import string
-    import random
-    return ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(N))
+# The bots think in worker processes, so that the app keeps responding and the bots of different games don't wait for each other
+bot_pool = None
+# Seconds between checks of whether a search has finished
+POLL_INTERVAL = 0.05
+# The version of the board that was last pushed to the GUI for each game, so that the next push only has the changes
+pushed = {}
 
 @eel.expose
 def start_game(game_name,black_player="you",white_player="you",komi=3.5):
-    words = game_name.split(' ')
-    if words[0] == 'USA':
-        G,pos = nets.usa_network()
-    if words[0] == 'KARATE':
-        G,pos = nets.karate_network()
-    if words[0] == 'DODECAHEDRAL':
-        G,pos = nets.dodecahedral_graph()
-    if words[0] == 'COMMUNITIES':
-        G,pos = nets.random_communities()
-    if words[0] == 'GRID':
-        G,pos = nets.generate_grid(int(words[1]),int(words[2]))
-    if words[0] == 'VORONOI':
-        G,pos = nets.random_voronoi(cells=(words[1]=='CELLS'))
-    if words[0] == 'REGULAR':
-        G,pos = nets.random_regular(int(words[1]),int(words[2]))
-    if words[0] == 'GEOMETRIC':
-        G,pos = nets.random_geometric(int(words[1]),int(words[2]))
-    game_key = generate_random_key()
-    active_games[game_key] = GoGame(G, komi=komi, pos=pos)
-    if black_player!="you" or white_player!="you":
-        active_bots[game_key] = {}
-        black_player_words = black_player.split(" ")
-        white_player_words = white_player.split(" ")
-        from bots import MiniMaxBot,AlphaBetaBot
-        if black_player_words[0]=="MiniMax":
-            active_bots[game_key][BLACK] = MiniMaxBot(depth=int(black_player_words[1]))
-        elif black_player_words[0]=="AlphaBeta":
-            active_bots[game_key][BLACK] = AlphaBetaBot(depth=int(black_player_words[1]),game=active_games[game_key])
-        if white_player_words[0]=="MiniMax":
-            active_bots[game_key][WHITE] = MiniMaxBot(depth=int(white_player_words[1]))
-        elif white_player_words[0]=="AlphaBeta":
-            active_bots[game_key][WHITE] = AlphaBetaBot(depth=int(white_player_words[1]),game=active_games[game_key])
-    eel.setGraph(get_graph(game_key))
-    eel.updateGui(get_info(game_key))
+    game_key = games.create(game_name,black_player,white_player,komi).key
+    for key in [key for key in pushed if key not in games]:
+        del pushed[key] # The game has been evicted
+    eel.setGraph(get_graph(game_key,binary=True))
+    push_info(game_key)
     next_turn(game_key)
     
 def get_game(game_key):
-    if game_key not in active_games:
-        raise Exception(f"Game {game_key} does not exist")
-    return active_games[game_key]
+    return games.get(game_key).game
+
+# Removes the game and stops the search of its bot, which frees its worker (see GameStore.remove)
+@eel.expose
+def abandon_game(game_key):
+    games.remove(game_key)
+    pushed.pop(game_key,None)
+
+def bot_to_move(game_key):
+    return games.get(game_key).bot_to_move()
 
 @eel.expose
 def make_move(game_key, move):
     print(move)
+    if bot_to_move(game_key):
+        eel.prompt_alerts("Wait for the bot to move.")
+        return
+    play_move(game_key,move)
+    next_turn(game_key)
+
+# Plays the move and updates the GUI. Returns whether the move was legal.
+def play_move(game_key,move):
     game = get_game(game_key)
     try:
         game.process_move(move)
+        return True
     except Exception as e:
         print(e)
         eel.prompt_alerts(str(e))
+        return False
     finally:
-        eel.updateGui(get_info(game_key))
-        next_turn(game_key)
+        push_info(game_key)
 
 @eel.expose
-def get_graph(game_key):
-    game = get_game(game_key)
-    return {
-        'pos': [[float(x),float(y)] for x,y in game.pos.values()],
-        'edges': [
-            (i,j) for i,j in game.G.edges
-        ],
-    }
+def get_graph(game_key,binary=False):
+    return games.get(game_key).graph(binary)
 
-def get_info(game_key):
-    game = get_game(game_key)
-    return {
-        'key': game_key,
-        'state': [int(s) for s in game.current_state()],
-        'komi': game.komi,
-        'turn': int(game.turn),
-        'captures': {
-            int(BLACK): game.captures[BLACK],
-            int(WHITE): game.captures[WHITE],
-        },
-        'ended': game.ended,
-        'score': {
-            int(BLACK): game.final_score[BLACK],
-            int(WHITE): game.final_score[WHITE],
-        } if game.ended else {},
-    }
+# The whole state of the game, or only the changes since the given version
+@eel.expose
+def get_info(game_key,since=None):
+    return games.get(game_key).info(since)
+
+# Sends the changes since the last push to the GUI
+def push_info(game_key):
+    info = get_info(game_key,pushed.get(game_key))
+    pushed[game_key] = info['version']
+    eel.updateGui(info)
 
+# Starts the bots of the game if one of them is to move and they aren't playing yet
 def next_turn(game_key):
-    game = get_game(game_key)
-    if game.ended:
-        return
-    if game_key in active_bots and game.turn in active_bots[game_key]:
-        bot = active_bots[game_key][game.turn]
+    if game_key in games and games.get(game_key).search is None and bot_to_move(game_key):
+        eel.spawn(play_bots,game_key)
+
+'''
+    Lets the bots play as long as one of them is to move, so that a game between two bots is played in one loop.
+    Every move is searched in the pool, while this greenlet sleeps until the search is done.
+'''
+def play_bots(game_key):
+    global bot_pool
+    if bot_pool is None:
+        bot_pool = ProcessPoolExecutor()
+    while game_key in games and games.get(game_key).search is None and bot_to_move(game_key):
+        session = games.get(game_key)
+        color = session.game.turn
         start_time = time()
-        print(f'{game.turn} bot is thinking')
-        move = bot.choose_move(game.gamenode)
-        print(f'{game.turn} took {time()-start_time}s to find a move')
-        make_move(game_key,move)
+        print(f'{color} bot is thinking')
+        future = bot_pool.submit(*session.bot_search())
+        session.search = future
+        push_info(game_key)
+        while not future.done():
+            eel.sleep(POLL_INTERVAL)
+        if future.cancelled() or game_key not in games:
+            # The game was abandoned
+            return
+        session.search = None
+        try:
+            move = future.result()
+        except Exception as e:
+            print(e)
+            move = 'pass'
+        print(f'{color} took {time()-start_time}s to find a move')
+        if game_key not in games:
+            return
+        if not play_move(game_key,move):
+            # A bot that plays an illegal move passes instead
+            play_move(game_key,'pass')
 
-eel.start('index.html')
\ No newline at end of file
+# The workers of the bot pool import this module, so the app is only started in the main process
+if __name__=='__main__':
+    multiprocessing.freeze_support()
+    eel.init('web')
+    eel.start('index.html')
\ No newline at end of file
@@ -0,0 +1,612 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import random
+import tracemalloc
+from time import perf_counter
+import numpy as np
+import networks as nets
+from gographs import GoGame,BoardGraph,PlayoutBoard,BLACK,WHITE,EMPTY,compute_territory
+from bots import MiniMaxBot,AlphaBetaBot,MCTSBot
+from records import GameRecord,write_records,validate
+
+'''
+    Simple benchmarks for the game engine. Run with `python benchmarks.py`.
+    `python benchmarks.py --suite` runs the regression suite: fixed measurements on every network, which can be saved
+    as JSON (--json) and compared against a saved baseline (--baseline). It exits with status 1 if any measurement is
+    slower than in the baseline by more than the tolerance.
+'''
+
+BOARDS = {
+    'GRID 9 9': lambda: nets.generate_grid(9,9),
+    'GRID 21 21': lambda: nets.generate_grid(21,21),
+    'USA': nets.usa_network,
+    'KARATE': nets.karate_network,
+}
+
+# All networks of the app, for the benchmarks that are cheap enough to run on each of them.
+# The random networks are generated with fixed seeds, so that every run uses the same boards.
+NETWORKS = {
+    'GRID 5 5': lambda: nets.generate_grid(5,5),
+    **BOARDS,
+    'DODECAHEDRAL': nets.dodecahedral_graph,
+    **{
+        name: lambda name=name: nets.generate_board(name,seed=0)
+        for name in ['COMMUNITIES','VORONOI CELLS','VORONOI RIDGES','REGULAR 20 3','GEOMETRIC 20 4']
+    },
+}
+
+# A sequence of random (possibly illegal) moves that is the same every time
+def random_moves(n,length,seed=0):
+    rng = random.Random(seed)
+    return [rng.randrange(n) for _ in range(length)]
+
+def bench_process_move(G,pos,moves):
+    game = GoGame(G,pos=pos)
+    start = perf_counter()
+    for move in moves:
+        try:
+            game.process_move(move)
+        except Exception:
+            pass
+    return (perf_counter()-start)/len(moves)
+
+def bench_apply_move(G,pos,moves):
+    game = GoGame(G,pos=pos)
+    node = game.gamenode
+    start = perf_counter()
+    for move in moves:
+        game.apply_move(move,node)
+    return (perf_counter()-start)/len(moves)
+
+# Memory of a state that follows from apply_move, averaged over the legal moves at the empty board
+def bench_state_size(G,pos):
+    game = GoGame(G,pos=pos)
+    node = game.gamenode
+    tracemalloc.start()
+    states = [game.apply_move(move,node) for move in range(len(G))]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size/len(states)
+
+# Memory that a game allocates on top of the networkx graph it is constructed from, per place
+def bench_footprint(G,pos):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    game = GoGame(G,pos=pos)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before,'filename'))
+    return size/len(G)
+
+# Plays the first moves of a game (skipping illegal ones), so that the bots search a position that isn't empty
+def game_after(G,pos,moves):
+    game = GoGame(G,pos=pos)
+    for move in moves:
+        try:
+            game.process_move(move)
+        except Exception:
+            pass
+    return game
+
+# Returns the number of evaluated leaves (one at a time or in batches) and the time that the bot needs to choose a move
+def bench_choose_move(bot,game):
+    leaves = 0
+    evaluate = bot.evaluate
+    evaluate_boards = bot.evaluate_boards
+    def counting_evaluate(node):
+        nonlocal leaves
+        leaves += 1
+        return evaluate(node)
+    def counting_evaluate_boards(game,boards,captures,ended):
+        nonlocal leaves
+        leaves += len(ended)
+        return evaluate_boards(game,boards,captures,ended)
+    bot.evaluate = counting_evaluate
+    bot.evaluate_boards = counting_evaluate_boards
+    start = perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        bot.choose_move(game.gamenode)
+    return leaves,perf_counter()-start
+
+def bench_transpositions():
+    for name in ['USA','GRID 9 9']:
+        G,pos = BOARDS[name]()
+        # We fill most of the board so that MiniMax doesn't take too long, and end with a pass
+        # so that the same positions are reached through different move orders
+        moves = random_moves(len(G),len(G),seed=1)+['pass']
+        for label,make_bot in [
+            ('MiniMax 3',lambda game,table_mb: MiniMaxBot(depth=3,table_mb=table_mb)),
+            ('AlphaBeta 3',lambda game,table_mb: AlphaBetaBot(depth=3,game=game,table_mb=table_mb)),
+        ]:
+            results = []
+            for table_mb in [None,64]:
+                game = game_after(G,pos,moves)
+                results.append(bench_choose_move(make_bot(game,table_mb),game))
+            (leaves,time),(tt_leaves,tt_time) = results
+            print(f'{name:12} {label:12} leaves: {leaves:7} -> {tt_leaves:7}, time: {time:6.2f}s -> {tt_time:6.2f}s')
+
+# Leaf evaluations per second, one at a time and in a batch of all children of a position
+def bench_batch_evaluate(name):
+    G,pos = BOARDS[name]()
+    game = game_after(G,pos,random_moves(len(G),len(G)//3,seed=1))
+    node = game.gamenode
+    node.appendAll()
+    children = list(node.childNodes.values())
+    bot = MiniMaxBot()
+    start = perf_counter()
+    for child in children:
+        bot.evaluate(child)
+    single = len(children)/(perf_counter()-start)
+    start = perf_counter()
+    bot.evaluate_batch(children)
+    batch = len(children)/(perf_counter()-start)
+    return single,batch
+
+# Number of calls of apply_move and time that AlphaBeta needs to choose a move, with all children created at once and with lazy expansion
+def bench_lazy(depth=3):
+    for name in ['USA','GRID 9 9']:
+        G,pos = BOARDS[name]()
+        moves = random_moves(len(G),len(G)//3,seed=1)
+        results = []
+        for lazy in [False,True]:
+            game = game_after(G,pos,moves)
+            calls = 0
+            apply_move = game.apply_move
+            def counting_apply_move(move,game_node,**kwargs):
+                nonlocal calls
+                calls += 1
+                return apply_move(move,game_node,**kwargs)
+            game.apply_move = counting_apply_move
+            _,time = bench_choose_move(AlphaBetaBot(depth=depth,game=game,lazy=lazy),game)
+            results.append((calls,time))
+        (calls,time),(lazy_calls,lazy_time) = results
+        print(f'{name:12} AlphaBeta {depth}  apply_move: {calls:7} -> {lazy_calls:7}, time: {time:6.2f}s -> {lazy_time:6.2f}s')
+
+# Time that AlphaBeta needs to choose a move without and with search statistics, and the statistics themselves
+def bench_stats(depth=3):
+    for name in ['USA','GRID 9 9']:
+        G,pos = BOARDS[name]()
+        moves = random_moves(len(G),len(G)//3,seed=1)
+        game = game_after(G,pos,moves)
+        _,time = bench_choose_move(AlphaBetaBot(depth=depth,game=game),game)
+        game = game_after(G,pos,moves)
+        bot = AlphaBetaBot(depth=depth,game=game,stats=True)
+        _,stats_time = bench_choose_move(bot,game)
+        stats = bot.last_stats
+        print(f'{name:12} AlphaBeta {depth}  time: {time:6.2f}s, with statistics: {stats_time:6.2f}s')
+        print(f'{name:12} nodes: {stats.nodes}, leaves: {stats.leaves}, branching factor: {stats.branching_factor():5.1f}, '
+              f'cutoffs by ply: {stats.cutoffs}, illegal: {stats.illegal}/{stats.checked}, '
+              + ', '.join(f'{part}: {seconds:5.2f}s' for part,seconds in stats.times.items())+f', pv: {stats.pv}')
+
+# Plays a game between two bots and returns the moves and the peak memory (in bytes) that was allocated during the game
+def play_game(G,pos,make_bot,max_moves,**kwargs):
+    tracemalloc.start()
+    game = GoGame(G,pos=pos,**kwargs)
+    bots = {BLACK: make_bot(game), WHITE: make_bot(game)}
+    with contextlib.redirect_stdout(io.StringIO()):
+        while not game.ended and len(game.moves)<max_moves:
+            game.process_move(bots[game.turn].choose_move(game.gamenode))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return game.moves,peak,game.peak_nodes,game.node_count
+
+# Peak memory of a game between two bots, keeping the whole game tree, pruning it and pruning it with a node budget
+def bench_tree_memory(name='USA',max_moves=40):
+    G,pos = BOARDS[name]()
+    make_bot = lambda game: AlphaBetaBot(depth=2,game=game,table_mb=None)
+    for label,kwargs in [
+        ('whole tree',{}),
+        ('500 nodes',{'max_nodes': 500}),
+        ('prune',{'prune': True}),
+        ('prune, 500 nodes',{'prune': True, 'max_nodes': 500}),
+    ]:
+        moves,peak,peak_nodes,nodes = play_game(G,pos,make_bot,max_moves,**kwargs)
+        print(f'{name:12} {len(moves)} moves, {label:16} peak memory: {peak/2**20:6.1f}MB, '
+              f'peak nodes: {peak_nodes:7}, nodes at the end: {nodes:7}')
+
+# Random playouts per second from the empty board, on their own and as part of the search of the MCTS bot
+def bench_playouts(name,playouts=1000):
+    G,pos = NETWORKS[name]()
+    game = GoGame(G,pos=pos)
+    board = PlayoutBoard(game.graph.neighbors,game.board.tolist(),(0,0),BLACK,game.komi)
+    rng = random.Random(0)
+    start = perf_counter()
+    for _ in range(playouts):
+        board.copy().playout(rng,3*len(G))
+    engine = playouts/(perf_counter()-start)
+    bot = MCTSBot(playouts=playouts,seed=0)
+    start = perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        bot.choose_move(game.gamenode)
+    return engine,playouts/(perf_counter()-start)
+
+# Time and memory of the distances between all places, as a networkx dict of dicts and in the shared board index
+def bench_static_index(name):
+    import networkx as nx
+    G,pos = BOARDS[name]()
+    game = GoGame(G,pos=pos)
+    tracemalloc.start()
+    start = perf_counter()
+    shortest_paths = dict(nx.shortest_path_length(game.G))
+    nx_time = perf_counter()-start
+    nx_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del shortest_paths
+    BoardGraph.cache.clear()
+    times = []
+    for _ in range(2):
+        start = perf_counter()
+        game = GoGame(G,pos=pos)
+        AlphaBetaBot(depth=3,game=game)
+        game.graph.distance_matrix()
+        times.append(perf_counter()-start)
+    print(f'{name:12} networkx distances: {nx_time:6.3f}s, {nx_size/2**20:6.1f}MB; distance matrix: '
+          f'{game.graph.distance_matrix().nbytes/2**20:6.1f}MB, new game and bot: {times[0]:6.3f}s, '
+          f'on the same board: {times[1]:6.3f}s')
+
+# Time that reading the score takes, compared to computing the territory from scratch with the group graph
+def bench_territory(name,games=10,seed=0):
+    G,pos = NETWORKS[name]()
+    n = len(G)
+    rng = random.Random(seed)
+    positions = 0
+    scratch = 0.0
+    live = 0.0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(games):
+            game = GoGame(G,pos=pos,prune=True)
+            for _ in range(8*n):
+                try:
+                    game.process_move(rng.randrange(n) if rng.random()>0.002 else 'pass')
+                except Exception:
+                    continue
+                if game.ended:
+                    break
+                start = perf_counter()
+                compute_territory(game.group_graph())
+                scratch += perf_counter()-start
+                start = perf_counter()
+                game.compute_score()
+                live += perf_counter()-start
+                positions += 1
+    return scratch/positions,live/positions
+
+'''
+    Plays random games on every network until both players pass and writes copies of their records to a file. Returns
+    the records per second and the moves per second of validating the file (reading and replaying), and the records
+    per second of replaying them in a GoGame. Replay is checked against the games.
+'''
+def bench_records(games=4,copies=50,seed=0):
+    import tempfile
+    rng = random.Random(seed)
+    records = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name,generate in NETWORKS.items():
+            G,pos = generate()
+            n = len(G)
+            for _ in range(games):
+                game = GoGame(G,pos=pos,prune=True)
+                while not game.ended:
+                    try:
+                        game.process_move(rng.randrange(n) if len(game.moves)<4*n and rng.random()>0.01 else 'pass')
+                    except Exception:
+                        pass
+                record = GameRecord.FromGame(game)
+                board = record.replay()
+                assert board.board==game.board.tolist() and record.final_score(board)==game.final_score,name
+                records.append(record)
+        start = perf_counter()
+        for record in records:
+            record.to_game(prune=True)
+        in_game = len(records)/(perf_counter()-start)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory,'records.jsonl.gz')
+        write_records(path,records*copies)
+        start = perf_counter()
+        count,moves,errors = validate(path)
+        elapsed = perf_counter()-start
+    assert count==len(records)*copies and not errors,errors[:1]
+    return count/elapsed,moves/elapsed,in_game
+
+'''
+    Bytes and time per update of the GUI, when the whole board is sent after every move and when only the changes are
+    sent, and the size of the graph as nested lists and as packed arrays. An update is the info of the game after a
+    random move, encoded as JSON as eel does.
+'''
+def bench_updates(names=['GRID 9 9','GRID 21 21','VORONOI CELLS 5000'],moves=200,seed=0):
+    import tempfile
+    from server import GameStore
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        store = GameStore(board_cache=nets.BoardCache(directory))
+        for name in names:
+            with contextlib.redirect_stdout(io.StringIO()):
+                session = store.create(name)
+            n = session.game.graph.n
+            length = min(moves,n//2) # Random moves fill the board, so we stop before that
+            sizes = {'full': 0, 'delta': 0}
+            times = {'full': 0.0, 'delta': 0.0}
+            version = session.info()['version']
+            played = 0
+            while played<length:
+                try:
+                    session.game.process_move(rng.randrange(n))
+                except Exception:
+                    continue
+                played += 1
+                session.sync() # Both kinds of updates log the changes first, so we leave that out
+                for label,since in [('delta',version),('full',None)]:
+                    start = perf_counter()
+                    info = session.info(since)
+                    sizes[label] += len(json.dumps(info))
+                    times[label] += perf_counter()-start
+                version = info['version']
+            graph = len(json.dumps(session.graph()))
+            packed = len(json.dumps(session.graph(binary=True)))
+            print(f'{name:18} update with the whole board: {sizes["full"]/played:8.0f}B, {1e6*times["full"]/played:6.1f}us; '
+                  f'with the changes: {sizes["delta"]/played:5.0f}B, {1e6*times["delta"]/played:6.1f}us; '
+                  f'graph: {graph/1024:7.1f}KB, packed: {packed/1024:7.1f}KB')
+            store.remove(session.key)
+
+'''
+    Builds an opening book for the first plies of a board and compares the time of the first moves of the bot with and
+    without the book, for the lines in which the opponent plays random moves. The values of the moves have to agree
+    (the moves may differ between moves of the same value).
+'''
+def bench_book(board='USA',description='AlphaBeta 2',plies=3,lines=10,seed=0):
+    import tempfile
+    from book import OpeningBook,build
+    from bots import make_bot
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        cache = nets.BoardCache(directory)
+        book = OpeningBook(os.path.join(directory,'book.sqlite'),record=False)
+        start = perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            searched = build(book,board,description,plies,color=BLACK,board_cache=cache)
+            built = perf_counter()-start
+            graph,_,_ = cache.load(board)
+            times = {'book': 0.0, 'search': 0.0}
+            moves = 0
+            for _ in range(lines):
+                game = GoGame(graph,prune=True)
+                while len(game.moves)<plies:
+                    if game.turn==BLACK:
+                        values = {}
+                        for label,bot in [('book',make_bot(description,game,book=book)),('search',make_bot(description,game))]:
+                            start = perf_counter()
+                            move = bot.choose_move(game.gamenode)
+                            times[label] += perf_counter()-start
+                            values[label] = bot.last_value
+                        assert abs(values['book']-values['search'])<1e-9,values
+                        moves += 1
+                    else:
+                        move = rng.choice(list(game.gamenode.generate_moves()))
+                    game.process_move(move)
+        print(f'{board} {description}: book of {searched} positions built in {built:.1f}s, first {plies} plies with the book: '
+              f'{1e3*times["book"]/moves:.2f}ms/move ({book.hits} hits), searched: {1e3*times["search"]/moves:.1f}ms/move')
+        book.close()
+
+# Nodes, leaves and time of searches of depth 3 from the empty board without and with the symmetries of the board
+def bench_symmetry(cases=[('DODECAHEDRAL','MiniMax'),('DODECAHEDRAL','AlphaBeta'),('GRID 5 5','MiniMax'),('GRID 5 5','AlphaBeta'),('GRID 9 9','AlphaBeta')],depth=3):
+    for name,kind in cases:
+        G,pos = NETWORKS[name]()
+        results = []
+        for symmetric in [False,True]:
+            game = GoGame(G,pos=pos)
+            if symmetric:
+                start = perf_counter()
+                symmetries = game.graph.symmetries()
+                found = perf_counter()-start
+            if kind=='MiniMax':
+                bot = MiniMaxBot(depth=depth,stats=True,symmetric=symmetric)
+            else:
+                bot = AlphaBetaBot(depth=depth,game=game,stats=True,symmetric=symmetric)
+            _,time = bench_choose_move(bot,game)
+            results.append((bot.last_stats,bot.last_value,time))
+        (stats,value,time),(symmetric_stats,symmetric_value,symmetric_time) = results
+        assert abs(value-symmetric_value)<1e-9,(value,symmetric_value)
+        print(f'{name:12} {kind} {depth}  {symmetries:4} symmetries found in {1e3*found:6.1f}ms, '
+              f'nodes: {stats.nodes:6} -> {symmetric_stats.nodes:6} ({stats.nodes/symmetric_stats.nodes:5.1f}x), '
+              f'leaves: {stats.leaves:7} -> {symmetric_stats.leaves:7} ({stats.leaves/symmetric_stats.leaves:5.1f}x), '
+              f'time: {time:6.2f}s -> {symmetric_time:6.2f}s')
+
+# Time to set up a game from the generator and from the board cache (after the board has been stored once)
+def bench_board_cache(names=['GRID 9 9','GRID 21 21','USA','KARATE','DODECAHEDRAL','COMMUNITIES','REGULAR 20 3']):
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        cache = nets.BoardCache(directory)
+        for name in names:
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = perf_counter()
+                G,pos = nets.generate_board(name,seed=0)
+                GoGame(G,pos=pos)
+                generated = perf_counter()-start
+                cache.load(name,seed=0)
+                start = perf_counter()
+                graph,names,pos = cache.load(name,seed=0)
+                GoGame(graph,pos=pos,names=names)
+                cached = perf_counter()-start
+            print(f'{name:14} new game from the generator: {1e3*generated:7.1f}ms, from the cache: {1e3*cached:7.1f}ms')
+        print(f'board cache: {cache.hits} hits, {cache.misses} misses')
+
+# Time to generate the random boards (including the layout) for an increasing number of places
+def bench_generators(sizes=[100,1000,5000]):
+    for name in ['REGULAR {} 3','COMMUNITIES {}','GEOMETRIC {} 4','VORONOI CELLS {}','VORONOI RIDGES {}']:
+        times = []
+        for n in sizes:
+            start = perf_counter()
+            nets.generate_board(name.format(n),seed=0)
+            times.append(perf_counter()-start)
+        print(f'{name.format("n"):16} '+', '.join(f'n={n}: {time:6.3f}s' for n,time in zip(sizes,times)))
+
+# Speedup of the parallel root search compared to the sequential search, for an increasing number of workers
+def bench_parallel(name='GRID 9 9',depth=3):
+    G,pos = BOARDS[name]()
+    moves = random_moves(len(G),len(G)//2,seed=2)
+    game = game_after(G,pos,moves)
+    _,sequential = bench_choose_move(AlphaBetaBot(depth=depth,game=game),game)
+    print(f'{name:12} AlphaBeta {depth}  sequential: {sequential:6.2f}s')
+    workers = 1
+    while workers<=os.cpu_count():
+        bot = AlphaBetaBot(depth=depth,game=game,workers=workers)
+        # Start the workers before timing
+        bot.get_pool(game)
+        _,parallel = bench_choose_move(bot,game)
+        bot.close()
+        print(f'{name:12} AlphaBeta {depth}  {workers:2} workers: {parallel:6.2f}s, speedup {sequential/parallel:5.2f}')
+        workers *= 2
+
+# Time, and memory allocated during the search (peak) and kept afterwards, when a bot searches the tree of game nodes and in place on a SearchBoard
+def bench_inplace():
+    for name in ['USA','GRID 9 9']:
+        G,pos = BOARDS[name]()
+        moves = random_moves(len(G),len(G)//3,seed=1)
+        for label,make_bot in [
+            ('AlphaBeta 3',lambda game,inplace: AlphaBetaBot(depth=3,game=game,inplace=inplace)),
+            ('MiniMax 2',lambda game,inplace: MiniMaxBot(depth=2,inplace=inplace)),
+        ]:
+            results = []
+            for inplace in [False,True]:
+                game = game_after(G,pos,moves)
+                _,time = bench_choose_move(make_bot(game,inplace),game)
+                game = game_after(G,pos,moves)
+                bot = make_bot(game,inplace)
+                tracemalloc.start()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    bot.choose_move(game.gamenode)
+                kept,peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                results.append((time,peak,kept))
+            (time,peak,kept),(inplace_time,inplace_peak,inplace_kept) = results
+            print(f'{name:12} {label:12} time: {time:6.2f}s -> {inplace_time:6.2f}s, '
+                  f'peak: {peak/2**20:6.1f}MB -> {inplace_peak/2**20:6.1f}MB, kept: {kept/2**20:6.1f}MB -> {inplace_kept/2**20:6.1f}MB')
+
+# The bots of the suite, with the largest board (in places) on which they are run
+SUITE_BOTS = {
+    'AlphaBeta 1': (lambda game: AlphaBetaBot(depth=1,game=game), None),
+    'AlphaBeta 2': (lambda game: AlphaBetaBot(depth=2,game=game), None),
+    'AlphaBeta 3': (lambda game: AlphaBetaBot(depth=3,game=game), 100),
+    'MiniMax 1': (lambda game: MiniMaxBot(depth=1), None),
+    'MiniMax 2': (lambda game: MiniMaxBot(depth=2), 100),
+}
+
+# The time of the fastest of repeats calls of f
+def best_of(f,repeats):
+    return min(f() for _ in range(repeats))
+
+# Time per leaf evaluation with heuristic_evaluate, on all children of a position
+def bench_evaluate(G,pos,moves):
+    node = game_after(G,pos,moves).gamenode
+    node.appendAll(verbose=False)
+    children = list(node.childNodes.values())
+    bot = MiniMaxBot()
+    start = perf_counter()
+    for child in children:
+        bot.evaluate(child)
+    return (perf_counter()-start)/len(children)
+
+'''
+    Runs the suite on the given networks and returns a dictionary from the names of the measurements to their
+    results. Every measurement is a time in seconds, so lower is always better.
+    The progress is printed to stderr.
+'''
+def run_suite(names=None,repeats=3):
+    if names is None:
+        names = list(NETWORKS)
+    results = {}
+    def record(name,measurement,value):
+        results[f'{name}: {measurement}'] = {'value': value, 'unit': 's'}
+        print(f'{name:14} {measurement:24} {1e6*value:12.1f}us',file=sys.stderr)
+    for name in names:
+        random.seed(0)
+        np.random.seed(0)
+        G,pos = NETWORKS[name]()
+        n = len(G)
+        replay = random_moves(n,4*n)
+        position = random_moves(n,n//3,seed=1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            record(name,'process_move',best_of(lambda: bench_process_move(G,pos,replay),repeats))
+            record(name,'apply_move',best_of(lambda: bench_apply_move(G,pos,replay),repeats))
+            record(name,'heuristic_evaluate',best_of(lambda: bench_evaluate(G,pos,position),repeats))
+            for label,(make_bot,max_places) in SUITE_BOTS.items():
+                if max_places is not None and n>max_places:
+                    continue
+                def choose_move():
+                    game = game_after(G,pos,position)
+                    return bench_choose_move(make_bot(game),game)[1]
+                record(name,f'{label} choose_move',best_of(choose_move,repeats))
+    return results
+
+# The measurements that are slower than in the baseline by more than the tolerance (a fraction), with both times
+def regressions(results,baseline,tolerance=0.25):
+    return {
+        key: (baseline[key]['value'],result['value'])
+        for key,result in results.items()
+        if key in baseline and result['value']>(1+tolerance)*baseline[key]['value']
+    }
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the game engine, the bots and the board generators.')
+    parser.add_argument('--suite',action='store_true',help='run the regression suite instead of all benchmarks')
+    parser.add_argument('--boards',nargs='+',default=None,help='networks of the suite (default all of them)')
+    parser.add_argument('--repeats',type=int,default=3,help='runs of each measurement of the suite, of which the fastest counts')
+    parser.add_argument('--json',default=None,help='file to which the results of the suite are written')
+    parser.add_argument('--baseline',default=None,help='results of an earlier run of the suite to compare against')
+    parser.add_argument('--tolerance',type=float,default=0.25,help='slowdown compared to the baseline that counts as a regression')
+    args = parser.parse_args()
+
+    if args.suite:
+        results = run_suite(args.boards,args.repeats)
+        if args.json is not None:
+            with open(args.json,'w') as file:
+                json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'results': results},file,indent=1)
+        if args.baseline is not None:
+            with open(args.baseline) as file:
+                baseline = json.load(file)['results']
+            for key,result in results.items():
+                if key in baseline:
+                    print(f'{key:40} {1e6*baseline[key]["value"]:12.1f}us -> {1e6*result["value"]:12.1f}us '
+                          f'({result["value"]/baseline[key]["value"]:5.2f}x)')
+            slower = regressions(results,baseline,args.tolerance)
+            for key,(before,after) in slower.items():
+                print(f'REGRESSION {key}: {1e6*before:.1f}us -> {1e6*after:.1f}us')
+            if slower:
+                sys.exit(1)
+        sys.exit(0)
+
+    for name,generate in BOARDS.items():
+        G,pos = generate()
+        moves = random_moves(len(G),4*len(G))
+        print(f'{name:12} process_move: {1e6*bench_process_move(G,pos,moves):8.1f}us/move, '
+              f'apply_move: {1/bench_apply_move(G,pos,moves):8.0f} moves/s, {bench_state_size(G,pos):6.0f}B/state, '
+              f'footprint: {bench_footprint(G,pos):7.1f}B/place')
+    for name in BOARDS:
+        single,batch = bench_batch_evaluate(name)
+        print(f'{name:12} heuristic_evaluate: {single:8.0f}/s, batch: {batch:8.0f}/s')
+    for name in NETWORKS:
+        engine,search = bench_playouts(name)
+        print(f'{name:14} playouts: {engine:6.0f}/s, in MCTS: {search:6.0f}/s')
+    for name in BOARDS:
+        bench_static_index(name)
+    for name in NETWORKS:
+        scratch,live = bench_territory(name)
+        print(f'{name:14} territory from scratch: {1e6*scratch:8.1f}us, live score: {1e6*live:5.2f}us')
+    replayed,moves,in_game = bench_records()
+    print(f'records: replay {replayed:6.0f} records/s ({moves:7.0f} moves/s), in a GoGame {in_game:6.0f} records/s')
+    bench_updates()
+    bench_book()
+    bench_symmetry()
+    bench_board_cache()
+    bench_generators()
+    bench_transpositions()
+    bench_lazy()
+    bench_inplace()
+    bench_stats()
+    bench_tree_memory()
+    bench_parallel()
@@ -0,0 +1,206 @@
+import argparse
+import contextlib
+import io
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor,as_completed
+from time import perf_counter
+import networks as nets
+from gographs import GoGame,BLACK,WHITE,EMPTY
+from bots import make_bot
+
+'''
+    Opening books: the moves that bots with a fixed depth chose in the opening of a board, so that they don't search
+    the same positions again. A book is an sqlite database with a row per board (its fingerprint), bot (see
+    MiniMaxBot.book_config) and position (see MiniMaxBot.book_key), with the chosen move and its value. Bots that use
+    the symmetries of the board store the moves of the symmetric position that the key belongs to.
+    Run `python book.py --help` to build a book for the first plies of some boards with many processes.
+'''
+
+DEFAULT_PATH = os.environ.get('GO_GRAPHS_BOOK',os.path.join(os.path.expanduser('~'),'.cache','go-graphs','book.sqlite'))
+
+# Position keys are unsigned 64 bit numbers, while sqlite stores signed ones
+def signed(key):
+    return key-(1<<64) if key>=1<<63 else key
+
+class OpeningBook:
+    '''
+        The book covers the positions in which no stones have been captured and at most plies stones have been played
+        (earlier boards can't come back in these positions, so the chosen move doesn't depend on the history).
+        With record, bots store the moves that they search in the covered positions.
+        Books are shared by the bots in a process (see Open), and a book that is sent to another process is opened
+        there again.
+    '''
+    opened = {}
+
+    def __init__(self,path=DEFAULT_PATH,plies=8,record=True):
+        self.path = path
+        self.plies = plies
+        self.record = record
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory,exist_ok=True)
+        self.connection = sqlite3.connect(path,timeout=30,isolation_level=None,check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS positions (board TEXT, bot TEXT, key INTEGER, move INTEGER, value REAL, '
+            'PRIMARY KEY (board,bot,key)) WITHOUT ROWID'
+        )
+        self.hits = 0
+        self.misses = 0
+
+    # Returns the book at path that is open in this process, or opens it
+    @classmethod
+    def Open(cls,path=DEFAULT_PATH,plies=8,record=True):
+        if (path,plies,record) not in cls.opened:
+            cls.opened[path,plies,record] = cls(path,plies,record)
+        return cls.opened[path,plies,record]
+
+    def __reduce__(self):
+        return OpeningBook.Open,(self.path,self.plies,self.record)
+
+    def covers(self,node):
+        state = node.state
+        if state[BLACK] or state[WHITE]:
+            return False
+        return len(state.board)-state.board.count(EMPTY)<=self.plies
+
+    # The move and its value for the position with the given key, or None if it isn't in the book
+    def lookup(self,graph,config,key):
+        row = self.connection.execute(
+            'SELECT move,value FROM positions WHERE board=? AND bot=? AND key=?',(graph.fingerprint,config,signed(key))
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        move,value = row
+        return ('pass' if move<0 else move),value
+
+    def store(self,graph,config,key,move,value):
+        self.store_many(graph,config,[(key,move,value)])
+
+    # Stores (key, move, value) triples in one transaction
+    def store_many(self,graph,config,entries):
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO positions VALUES (?,?,?,?,?)',
+            [
+                (graph.fingerprint,config,signed(key),-1 if move=='pass' else int(move),value)
+                for key,move,value in entries
+            ]
+        )
+
+    # The number of positions in the book for each board and bot
+    def summary(self):
+        return self.connection.execute('SELECT board,bot,COUNT(*) FROM positions GROUP BY board,bot').fetchall()
+
+    def close(self):
+        self.connection.close()
+        OpeningBook.opened.pop((self.path,self.plies,self.record),None)
+
+_builder = {}
+
+def _init_builder(description,graph,komi):
+    with contextlib.redirect_stdout(io.StringIO()):
+        game = GoGame(graph,komi=komi)
+        _builder['bot'] = make_bot(description,game)
+    _builder['graph'] = graph
+    _builder['komi'] = komi
+
+def replay(graph,komi,line):
+    game = GoGame(graph,komi=komi,prune=True)
+    for move in line:
+        game.process_move(move)
+    return game
+
+# Searches the position after the moves of line in a worker process, and returns the line, the chosen move and its value
+def _search_line(line):
+    bot = _builder['bot']
+    with contextlib.redirect_stdout(io.StringIO()):
+        game = replay(_builder['graph'],_builder['komi'],line)
+        bot.game = game
+        move = bot.choose_move(game.gamenode)
+    return line,move,bot.last_value
+
+'''
+    Adds the moves of the bot with the given description to the book, for the positions in the first plies moves in
+    which the bot plays color: the bot answers every legal move of its opponent (including pass) with the move that it
+    chooses. The positions are searched in parallel by workers processes, and the positions that are already in the
+    book are skipped. Returns the number of positions that were searched.
+'''
+def build(book,board,description,plies,color=BLACK,komi=3.5,workers=None,board_cache=None,verbose=True):
+    if board_cache is None:
+        board_cache = nets.BoardCache()
+    with contextlib.redirect_stdout(io.StringIO()):
+        graph,_,_ = board_cache.load(board)
+        bot = make_bot(description,GoGame(graph,komi=komi),table_mb=None)
+    config = bot.book_config(komi)
+    if config is None:
+        raise Exception(f"{description} doesn't always choose the same move, so it can't have a book")
+    searched = 0
+    lines = [[]]
+    with ProcessPoolExecutor(workers,initializer=_init_builder,initargs=(description,graph,komi)) as pool:
+        for ply in range(plies):
+            turn = BLACK if ply%2==0 else WHITE
+            positions = {} # The lines to search by the key of their position, which is searched once however it is reached
+            known = []
+            seen = set()
+            replies = []
+            for line in lines:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    node = replay(graph,komi,line).gamenode
+                if node.state.ended or not book.covers(node):
+                    continue
+                if turn!=color:
+                    replies += [line+[move] for move in node.generate_moves()]
+                    continue
+                key,g = bot.book_key(node)
+                if key in seen:
+                    continue
+                seen.add(key)
+                entry = book.lookup(graph,config,key)
+                if entry is None:
+                    positions[key] = (line,g)
+                else:
+                    known.append(line+[graph.from_canonical(entry[0],g)])
+            if turn!=color:
+                lines = replies
+                continue
+            start = perf_counter()
+            futures = {pool.submit(_search_line,line): (key,g) for key,(line,g) in positions.items()}
+            lines = known[:]
+            entries = []
+            for future in as_completed(futures):
+                line,move,value = future.result()
+                key,g = futures[future]
+                entries.append((key,graph.to_canonical(move,g),value))
+                lines.append(line+[move])
+            book.store_many(graph,config,entries)
+            searched += len(entries)
+            if verbose:
+                print(f'{board}, {description} as {color}, ply {ply}: searched {len(entries)} positions '
+                      f'({len(known)} were in the book) in {perf_counter()-start:.1f}s')
+    return searched
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Builds an opening book for bots with a fixed depth.')
+    parser.add_argument('--book',default=DEFAULT_PATH)
+    parser.add_argument('--boards',nargs='+',default=['USA','KARATE','DODECAHEDRAL','GRID 5 5','GRID 9 9'],
+                        help='board names as accepted by networks.generate_board (random boards need the same seed to be found again)')
+    parser.add_argument('--bots',nargs='+',default=['AlphaBeta 2','AlphaBeta 3','MiniMax 2'],help='bot descriptions as accepted by bots.make_bot')
+    parser.add_argument('--plies',type=int,default=4,help='moves of both players that are covered')
+    parser.add_argument('--komi',type=float,default=3.5)
+    parser.add_argument('--workers',type=int,default=None)
+    args = parser.parse_args()
+
+    book = OpeningBook(args.book,plies=max(args.plies,8))
+    start = perf_counter()
+    searched = 0
+    for board in args.boards:
+        for description in args.bots:
+            for color in [BLACK,WHITE]:
+                searched += build(book,board,description,args.plies,color,args.komi,args.workers)
+    print(f'Searched {searched} positions in {perf_counter()-start:.1f}s')
+    for board,bot,count in book.summary():
+        print(f'{board} {bot}: {count} positions')
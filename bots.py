@@ -1,47 +1,483 @@
-from gographs import EMPTY,BLACK,WHITE,compute_territory,GameNode
+import gc
+import json
+import math
+import random
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from time import perf_counter
+import numpy as np
+from gographs import EMPTY,BLACK,WHITE,GameNode,GoGame,PlayoutBoard,SearchBoard
+
+# Seconds between the checks of whether a search has been cancelled, since a check asks the process of the event
+CANCEL_INTERVAL = 0.02
+
+class SearchCancelled(Exception):
+    pass
 
 class Bot:
     '''
         node is a GameNode, with a reference to the game. This returns an index representing the place that is being played, or the string "pass".
+        While cancel is an event (like a multiprocessing Manager().Event()), the search stops with SearchCancelled once it is set.
     '''
+    cancel = None
+    next_cancel_check = 0.0
+
     def choose_move(self,node):
         pass
 
+    def check_cancelled(self):
+        if self.cancel is not None and perf_counter()>=self.next_cancel_check:
+            self.next_cancel_check = perf_counter()+CANCEL_INTERVAL
+            if self.cancel.is_set():
+                raise SearchCancelled()
+
 def heuristic_evaluate(node,freedom_to_value={1:0.1, 2: 0.2, 3: 0.4, 4: 0.5}):
-    captures = node.state.captures()
-    gg = node.game.group_graph(node.state)
-    territory = compute_territory(gg)
-    score = captures[BLACK]-captures[WHITE]+territory[BLACK]-territory[WHITE]-node.game.komi
-    # If the game is ended, then we return the true score
-    if node.state.ended:
-        return score
+    state = node.state
+    return batch_heuristic_evaluate(node.game,[state.array()],[(state[BLACK],state[WHITE])],[state.ended],freedom_to_value)[0]
+
+'''
+    Evaluates N positions at once. boards is an (N,n) array of statuses, captures an (N,2) array with the captures of
+    black and white, and ended tells for each position whether the game has ended. Returns a list of N scores.
+'''
+def batch_heuristic_evaluate(game,boards,captures,ended,freedom_to_value={1:0.1, 2: 0.2, 3: 0.4, 4: 0.5}):
+    groups = game.graph.batch_groups(boards)
+    territory_black,territory_white = groups.territories()
+    captures = np.asarray(captures,dtype=np.int64).reshape(-1,2)
+    scores = (captures[:,0]-captures[:,1]+territory_black-territory_white).tolist()
+    
+    stones = groups.status!=EMPTY
+    sign = np.where(groups.status[stones]==BLACK,1,-1)
+    freedoms = groups.liberty_edges[stones]
+    alivefactor = np.where(groups.regions[stones]>1,2,1)
+    values = alivefactor * sign * groups.size[stones] * freedom_values(freedom_to_value)[np.minimum(freedoms,max(freedom_to_value)+1)]
+    # Sort the values of the groups by board
+    board_of = groups.board_of[stones]
+    order = np.argsort(board_of,kind='stable')
+    bounds = np.searchsorted(board_of[order],np.arange(groups.n_boards+1)).tolist()
+    values = values[order].tolist()
     
-    for i in gg.nodes:
-        data = gg.nodes[i]
-        if data['status']==EMPTY:
-            continue
-        sign = 1 if data['status']==BLACK else -1
-        freedoms = gg.degree(i)
-        alivefactor = 2 if len(list(gg.neighbors(i)))>1 else 1
-        #print(i,data['size'],freedoms,sign * data['size'] * (freedom_to_value[freedoms] if freedoms in freedom_to_value else max(freedom_to_value.values())))
-        score += alivefactor * sign * data['size'] * (freedom_to_value[freedoms] if freedoms in freedom_to_value else max(freedom_to_value.values()))
-    return score
+    result = []
+    for b,score in enumerate(scores):
+        score = score-game.komi
+        # If the game is ended, then we return the true score
+        if ended[b]:
+            result.append(score)
+        else:
+            # fsum makes the score independent of the order in which the groups are found
+            result.append(math.fsum([score]+values[bounds[b]:bounds[b+1]]))
+    return result
+
+# Lookup table for freedom_to_value: entry k is the value of a group with k freedoms, the last entry is used for any higher number
+def freedom_values(freedom_to_value):
+    return np.array([
+        freedom_to_value[freedoms] if freedoms in freedom_to_value else max(freedom_to_value.values())
+        for freedoms in range(max(freedom_to_value)+2)
+    ])
+
+# Keys that are xor-ed into the Zobrist hash of the board to distinguish the side to move and whether the last move was a pass
+WHITE_TO_MOVE_KEY = 0x9e3779b97f4a7c15
+PASSED_KEY = 0xd1b54a32d192ed03
+# The score depends on the difference in captures, so this is mixed into the key as well
+CAPTURES_KEY = 0x8cb92ba72f3d8dd7
+KEY_MASK = (1<<64)-1
+# Multiplied by the last move to mix it into the key of a position in an opening book
+LAST_MOVE_KEY = 0xbf58476d1ce4e5b9
+
+# The key of the position at node, for the hash of its board (or of a symmetric board, see MiniMaxBot.table_key)
+def position_key(node,zobrist=None):
+    state = node.state
+    key = (state.zobrist if zobrist is None else zobrist) ^ ((state[BLACK]-state[WHITE])*CAPTURES_KEY & KEY_MASK)
+    if node.turn==WHITE:
+        key ^= WHITE_TO_MOVE_KEY
+    if state.passed:
+        key ^= PASSED_KEY
+    return key
+
+class TranspositionTable:
+    '''
+        Fixed-size table that maps position keys to (key, depth, value, flag, best move, generation), so that positions
+        that are reached by different move orders are only searched once. Each key has a single slot, and an entry is
+        replaced when the new one is at least as deep or the old one was stored during an earlier search.
+        The flag tells whether the value is exact or a lower/upper bound (for alpha-beta search).
+    '''
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+    ENTRY_BYTES = 200 # Rough size of an entry, including its slot and the objects it refers to
+
+    def __init__(self,size_mb=64):
+        self.size = max(1,int(size_mb*2**20)//self.ENTRY_BYTES)
+        self.slots = [None]*self.size
+        self.generation = 0
+
+    # Should be called at the start of every search, so that older entries are replaced first
+    def new_search(self):
+        self.generation += 1
+
+    def lookup(self,key):
+        entry = self.slots[key%self.size]
+        if entry is not None and entry[0]==key:
+            return entry
+
+    def store(self,key,depth,value,flag,move=None):
+        i = key%self.size
+        entry = self.slots[i]
+        if entry is None or entry[5]!=self.generation or depth>=entry[1]:
+            self.slots[i] = (key,depth,value,flag,move,self.generation)
+
+    def clear(self):
+        self.slots = [None]*self.size
+
+
+class SearchStats:
+    '''
+        Statistics of one search of a MiniMaxBot or AlphaBetaBot: the positions that were expanded, the leaves that
+        were evaluated, the alpha-beta cutoffs by ply (the root is ply 0), the children that were searched, the
+        placements that were checked and how many of them were illegal, the time spent in move generation (checking
+        placements), in applying moves and in evaluation, and the principal variation.
+        While a search runs, the methods of the game (and of the SearchBoard) that generate and apply moves are
+        replaced by timed versions, so that a search without statistics runs the same code as before.
+        Only the part of a search that runs in this process is counted, so with workers most of it is missed.
+    '''
+    def __init__(self):
+        self.nodes = 0
+        self.leaves = 0
+        self.children = 0
+        self.cutoffs = {}
+        self.checked = 0
+        self.illegal = 0
+        self.times = {'move_generation': 0.0, 'apply_move': 0.0, 'evaluation': 0.0}
+        self.seconds = 0.0
+        self.root_depth = None
+        self.completed_depth = None # The deepest iteration that iterative deepening finished
+        self.move = None
+        self.pv = []
+        self.best_moves = {} # The best moves of the expanded positions by their key, for bots without a transposition table
+        self.nested = 0.0 # Total time of the timed calls so far, to subtract the calls that are made inside other timed calls
+        self.patched = []
+
+    def branching_factor(self):
+        return self.children/self.nodes if self.nodes else 0.0
+
+    def cutoff(self,depth):
+        ply = self.root_depth-depth
+        self.cutoffs[ply] = self.cutoffs.get(ply,0)+1
+
+    # Runs f and adds the time it takes, minus the time of the timed calls it makes, to times[name]
+    def timed(self,name,f,*args,**kwargs):
+        nested = self.nested
+        start = perf_counter()
+        result = f(*args,**kwargs)
+        elapsed = perf_counter()-start
+        self.times[name] += elapsed-(self.nested-nested)
+        self.nested = nested+elapsed
+        return result
+
+    def evaluate(self,leaves,f,*args):
+        self.leaves += leaves
+        return self.timed('evaluation',f,*args)
+
+    # Replaces the method name of obj by a timed version until restore is called. illegal tells whether a result means that the move was illegal.
+    def patch(self,obj,name,bucket,illegal=None):
+        method = getattr(obj,name)
+        def timed_method(*args,**kwargs):
+            result = self.timed(bucket,method,*args,**kwargs)
+            if illegal is not None:
+                self.checked += 1
+                if illegal(result):
+                    self.illegal += 1
+            return result
+        self.patched.append((obj,name,obj.__dict__.get(name)))
+        setattr(obj,name,timed_method)
+
+    def instrument_game(self,game):
+        self.patch(game,'check_move','move_generation',illegal=lambda result: isinstance(result,str))
+        self.patch(game,'apply_move','apply_move')
+
+    def instrument_board(self,board):
+        self.patch(board,'check','move_generation',illegal=lambda result: result is None)
+        self.patch(board,'play','apply_move')
+        self.patch(board,'undo','apply_move')
+
+    def restore(self):
+        for obj,name,previous in reversed(self.patched):
+            if previous is None:
+                delattr(obj,name)
+            else:
+                setattr(obj,name,previous)
+        self.patched = []
+
+    def as_dict(self):
+        return {
+            'move': self.move,
+            'seconds': self.seconds,
+            'nodes': self.nodes,
+            'leaves': self.leaves,
+            'branching_factor': self.branching_factor(),
+            'cutoffs': {str(ply): count for ply,count in sorted(self.cutoffs.items())},
+            'checked': self.checked,
+            'illegal': self.illegal,
+            'times': dict(self.times),
+            'pv': self.pv,
+            'completed_depth': self.completed_depth,
+        }
+
+
+# State of a search worker process: the bot, the board graph and the komi, which are sent once when the worker starts
+_worker = {}
+
+def _init_worker(bot,graph,komi):
+    bot.table = TranspositionTable(bot.table_mb) if bot.table_mb else None
+    _worker['bot'] = bot
+    _worker['graph'] = graph
+    _worker['komi'] = komi
+
+# Searches the child of the snapshot position that follows after move, in a worker process
+def _search_move(snapshot,move,alpha,beta,depth):
+    bot = _worker['bot']
+    # The moves of one search share the snapshot, so we only set up the game once
+    if _worker.get('snapshot')!=snapshot:
+        _worker['snapshot'] = snapshot
+        _worker['game'] = GoGame.FromSnapshot(_worker['graph'],_worker['komi'],snapshot)
+    game = _worker['game']
+    bot.game = game
+    if bot.table is not None:
+        bot.table.new_search()
+    child = bot.enter(bot.root(game.gamenode),move)
+    if isinstance(bot,AlphaBetaBot):
+        return bot.minimax(child,alpha,beta,depth=depth)[0]
+    return bot.minimax(child,depth=depth)
+
+# The bots that choose_move_in_worker has used in this process, by key, with the most recently used last
+_worker_bots = OrderedDict()
+WORKER_BOTS = 64
+# The transposition tables of the bots that a worker keeps take at most this many megabytes together
+WORKER_TABLES_MB = 256
+
+'''
+    Chooses a move with bot for the position of snapshot, in a worker process of a pool that is shared by several games.
+    The first bot that is sent with a key is kept in the worker, so that it keeps its transposition table (or its random
+    generator) for the later moves with that key that this worker gets. When last_move is given, the position is the
+    one after last_move is played from snapshot, so that the bot knows the last move. The least recently used bots are
+    dropped when the worker keeps more than WORKER_BOTS bots or their tables take more than WORKER_TABLES_MB.
+    The search stops with SearchCancelled when the event cancel is set.
+'''
+def choose_move_in_worker(key,bot,graph,komi,snapshot,last_move=None,cancel=None):
+    if key in _worker_bots:
+        bot = _worker_bots[key]
+        _worker_bots.move_to_end(key)
+    else:
+        _worker_bots[key] = bot
+        while len(_worker_bots)>1 and (
+            len(_worker_bots)>WORKER_BOTS
+            or sum(getattr(kept,'table_mb',None) or 0 for kept in _worker_bots.values())>WORKER_TABLES_MB
+        ):
+            _worker_bots.popitem(last=False)
+        if getattr(bot,'table_mb',None):
+            bot.table = TranspositionTable(bot.table_mb)
+    game = GoGame.FromSnapshot(graph,komi,snapshot)
+    if last_move is not None:
+        game.process_move(last_move)
+    bot.game = game
+    bot.cancel = cancel
+    try:
+        return bot.choose_move(game.gamenode)
+    finally:
+        bot.cancel = None
+
 
 class MiniMaxBot(Bot):
-    def __init__(self,depth=3,freedom_to_value={1:0.1, 2: 0.2, 3: 0.4, 4: 0.5}):
+    '''
+        table_mb is the memory cap of the transposition table, or None to search without one.
+        Only results of searches of the same depth are reused, so the chosen moves do not depend on the table.
+        When workers is given, the moves at the root are searched in parallel by that many processes.
+        With batch, the leaves below a node are evaluated together by batch_heuristic_evaluate.
+        With inplace, the search plays and undoes moves on a SearchBoard instead of building the tree of game nodes.
+        With stats, every search collects a SearchStats, which is kept in last_stats and appended as a line of JSON
+        to stats_file (if given).
+        book is an OpeningBook (see book.py) in which choose_move looks up the positions that it covers before
+        searching them, and in which it records the moves that it searched if the book records them.
+        With symmetric, positions that an automorphism of the board maps to each other share their entries in the
+        transposition table and the book, and only one of the moves that lead to symmetric positions is searched.
+    '''
+    def __init__(self,depth=3,freedom_to_value={1:0.1, 2: 0.2, 3: 0.4, 4: 0.5},table_mb=64,workers=None,batch=True,inplace=False,
+                 stats=False,stats_file=None,book=None,symmetric=False):
         super().__init__()
         self.freedom_to_value = freedom_to_value
         self.depth = depth
+        self.batch = batch
+        self.inplace = inplace
+        self.collect_stats = stats
+        self.stats_file = stats_file
+        self.stats = None # The statistics of the search that is running
+        self.last_stats = None
+        self.table_mb = table_mb
+        self.table = TranspositionTable(table_mb) if table_mb else None
+        self.workers = workers
+        self.pool = None
+        self.pool_graph = None
+        self.book = book
+        self.symmetric = symmetric
+        self.last_value = None # The value of the move that was chosen last, if the search knows it
+
+    # The pool, game and table stay in this process; workers start with an empty table
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(pool=None,pool_graph=None,table=None,game=None,stats=None,last_stats=None,cancel=None)
+        return state
+
+    def get_pool(self,game):
+        if self.pool is None or self.pool_graph is not game.graph:
+            self.close()
+            self.pool = ProcessPoolExecutor(self.workers,initializer=_init_worker,initargs=(self,game.graph,game.komi))
+            self.pool_graph = game.graph
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
 
     def evaluate(self,node):
+        if self.stats is not None:
+            return self.stats.evaluate(1,heuristic_evaluate,node,self.freedom_to_value)
         return heuristic_evaluate(node,self.freedom_to_value)
 
+    def evaluate_boards(self,game,boards,captures,ended):
+        if self.stats is not None:
+            return self.stats.evaluate(len(ended),batch_heuristic_evaluate,game,boards,captures,ended,self.freedom_to_value)
+        return batch_heuristic_evaluate(game,boards,captures,ended,self.freedom_to_value)
+
+    def evaluate_batch(self,nodes):
+        return self.evaluate_boards(
+            nodes[0].game,
+            np.frombuffer(b''.join([node.state.board.tobytes() for node in nodes]),dtype=np.int8).reshape(len(nodes),-1),
+            [(node.state[BLACK],node.state[WHITE]) for node in nodes],
+            [node.state.ended for node in nodes]
+        )
+
+    # The position that a search from node starts at
+    def root(self,node):
+        if not self.inplace:
+            return node
+        board = SearchBoard(node)
+        if self.stats is not None:
+            self.stats.instrument_board(board)
+        return board
+
+    '''
+        The key of node in the transposition table, and the symmetry g of the board that maps node to the position of
+        the key. Moves are stored in the numbering of that position (see BoardGraph.to_canonical).
+    '''
+    def table_key(self,node):
+        graph = node.game.graph
+        if self.symmetric and graph.symmetries()>1:
+            zobrist,g = graph.canonical_hash(node.state.board)
+            return position_key(node,zobrist),g
+        return position_key(node),0
+
+    # The places to consider at node when symmetric moves are searched once, or None for all of them
+    def distinct_places(self,node):
+        state = node.state
+        # After a capture, an earlier board could come back after one move but not after a symmetric one
+        if not self.symmetric or state[BLACK] or state[WHITE]:
+            return None
+        return node.game.graph.distinct_places(state.board)
+
+    # The legal moves at node, which is a GameNode or a SearchBoard
+    def legal_moves(self,node):
+        places = self.distinct_places(node)
+        if isinstance(node,SearchBoard) or places is not None:
+            return list(node.generate_moves(places=places))
+        node.appendAll(verbose=False)
+        return list(node.childNodes)
+
+    # The position after move: the child of a GameNode, or the SearchBoard itself after playing move. Call leave(child) when done.
+    def enter(self,node,move):
+        if isinstance(node,SearchBoard):
+            node.play(move)
+            return node
+        return node.child(move)
+
+    def leave(self,child):
+        if isinstance(child,SearchBoard):
+            child.undo()
+
+    # The key in the transposition table (if any), the board, the captures and whether the game has ended after move
+    def leaf(self,node,move):
+        child = self.enter(node,move)
+        state = child.state
+        leaf = (None if self.table is None else self.table_key(child)[0],state.board.tobytes(),state._captures,state.ended)
+        self.leave(child)
+        return leaf
+
+    # Returns a dictionary from moves to the values of the children of node (after the given moves, or all of them) as leaves, evaluating them in one batch
+    def evaluate_children(self,node,moves=None):
+        if moves is None:
+            moves = self.legal_moves(node)
+        values = {}
+        pending = []
+        for move in moves:
+            key,board,captures,ended = self.leaf(node,move)
+            if key is not None and not ended:
+                entry = self.table.lookup(key)
+                if entry is not None and entry[1]==0:
+                    values[move] = entry[2]
+                    continue
+            pending.append((move,key,board,captures,ended))
+        if pending:
+            results = self.evaluate_boards(
+                node.game,
+                np.frombuffer(b''.join([leaf[2] for leaf in pending]),dtype=np.int8).reshape(len(pending),-1),
+                [leaf[3] for leaf in pending],
+                [leaf[4] for leaf in pending]
+            )
+            for (move,key,_,_,ended),value in zip(pending,results):
+                values[move] = value
+                if key is not None and not ended:
+                    self.table.store(key,0,value,TranspositionTable.EXACT)
+        return values
+
+    def child_value(self,node,move,depth):
+        child = self.enter(node,move)
+        value = self.minimax(child,depth=depth)
+        self.leave(child)
+        return value
+
     def minimax(self,node,depth=3):
-        if node.state.ended or depth==0:
+        self.check_cancelled()
+        if node.state.ended or (depth==0 and self.table is None):
             return self.evaluate(node)
-        opt = max if node.turn==BLACK else min
-        node.appendAll(verbose=False)
-        return opt(map(lambda child: self.minimax(child,depth=depth-1),node.childNodes.values()))
+        if self.table is not None:
+            key,g = self.table_key(node)
+            entry = self.table.lookup(key)
+            if entry is not None and entry[1]==depth:
+                return entry[2]
+        if depth==0:
+            # Leaves are stored as well, since the transpositions of a search of depth d are mostly found at depth d
+            value = self.evaluate(node)
+            move = None
+        else:
+            if depth==1 and self.batch:
+                values = self.evaluate_children(node)
+            else:
+                values = {move: self.child_value(node,move,depth-1) for move in self.legal_moves(node)}
+            if self.stats is not None:
+                self.stats.nodes += 1
+                self.stats.children += len(values)
+            move = (max if node.turn==BLACK else min)(values,key=values.get)
+            value = values[move]
+            if self.table is None and self.stats is not None:
+                self.remember_best_move(node,move)
+        if self.table is not None:
+            self.table.store(key,depth,value,TranspositionTable.EXACT,node.game.graph.to_canonical(move,g))
+        return value
+
+    # Without a transposition table, the best moves are kept in the statistics for the principal variation
+    def remember_best_move(self,node,move):
+        key,g = self.table_key(node)
+        self.stats.best_moves[key] = node.game.graph.to_canonical(move,g)
         
 
     def move_seq(self,recursive_dict,initial_move):
@@ -51,52 +487,259 @@ class MiniMaxBot(Bot):
         return [initial_move]
 
 
+    '''
+        The bot in the key of the positions in an opening book: everything that the chosen move depends on, or None
+        when the bot doesn't always choose the same move in the same position.
+    '''
+    def book_config(self,komi):
+        return f'MiniMax {self.depth} {sorted(self.freedom_to_value.items())}{" symmetric" if self.symmetric else ""} komi {komi}'
+
+    # The key of node in an opening book and the symmetry of its moves in the book, as in table_key
+    def book_key(self,node):
+        return self.table_key(node)
+
     def choose_move(self,node):
-        node.appendAll(verbose=False)
+        book = self.book
+        config = None
+        if book is not None and book.covers(node):
+            config = self.book_config(node.game.komi)
+        graph = node.game.graph
+        if config is not None:
+            key,g = self.book_key(node)
+            entry = book.lookup(graph,config,key)
+            # A move that isn't legal here comes from a position with the same key
+            if entry is not None:
+                move = graph.from_canonical(entry[0],g)
+                if move=='pass' or node.child(move) is not None:
+                    self.last_value = entry[1]
+                    return move
+        self.last_value = None
+        move = self.timed_search(node)
+        if config is not None and book.record:
+            book.store(graph,config,key,graph.to_canonical(move,g),self.last_value)
+        return move
+
+    # Searches the move at node, collecting statistics if they are asked for
+    def timed_search(self,node):
+        if not self.collect_stats:
+            return self.search(node)
+        stats = self.stats = SearchStats()
+        stats.root_depth = self.depth
+        stats.instrument_game(node.game)
+        start = perf_counter()
+        try:
+            move = self.search(node)
+        finally:
+            stats.restore()
+            self.stats = None
+        stats.seconds = perf_counter()-start
+        stats.move = move
+        stats.pv = self.principal_variation(node,move,stats.best_moves)
+        self.last_stats = stats
+        if self.stats_file is not None:
+            with open(self.stats_file,'a') as file:
+                file.write(json.dumps(stats.as_dict())+'\n')
+        return move
+
+    '''
+        The best line of play from node when move is chosen, as far as the transposition table (or best_moves, without a
+        table) remembers the best moves.
+    '''
+    def principal_variation(self,node,move,best_moves=None):
+        pv = [move]
+        if self.table is None and not best_moves:
+            return pv
+        board = SearchBoard(node)
+        board.play(move)
+        while len(pv)<(self.depth or 64):
+            key,g = self.table_key(board)
+            if self.table is not None:
+                entry = self.table.lookup(key)
+                best = None if entry is None else entry[4]
+            else:
+                best = best_moves.get(key)
+            if best is None:
+                break
+            move = board.graph.from_canonical(best,g)
+            if not board.play(move):
+                break
+            pv.append(move)
+        return pv
+
+    def search(self,node):
+        if self.table is not None:
+            self.table.new_search()
+        position = self.root(node)
+        moves = self.legal_moves(position)
+        if self.stats is not None:
+            self.stats.nodes += 1
+            self.stats.children += len(moves)
         opt = max if node.turn==BLACK else min
-        move_dict = {
-            move: self.minimax(child,depth=self.depth-1)
-            for move,child in node.childNodes.items()
-        }
+        if self.workers is not None:
+            pool = self.get_pool(node.game)
+            snapshot = node.snapshot()
+            futures = {
+                move: pool.submit(_search_move,snapshot,move,None,None,self.depth-1)
+                for move in moves
+            }
+            move_dict = {move: future.result() for move,future in futures.items()}
+        elif self.depth==1 and self.batch:
+            move_dict = self.evaluate_children(position,moves)
+        else:
+            move_dict = {
+                move: self.child_value(position,move,self.depth-1)
+                for move in moves
+            }
         print(move_dict)
         move = opt(move_dict,key=move_dict.get)
+        self.last_value = move_dict[move]
         return move
 
+class SearchTimeout(Exception):
+    pass
+
 class AlphaBetaBot(MiniMaxBot):
-    def __init__(self, depth=3, freedom_to_value={ 1: 0.1,2: 0.2,3: 0.4,4: 0.5 }, game=None,no_sort = False):
-        import networkx as nx
-        super().__init__(depth, freedom_to_value)
+    '''
+        With lazy, the children of a node are only created when the search reaches them, so the moves after a cutoff
+        are never applied. The leaves are then evaluated in batches that grow from 8 to 64 moves.
+        When time_limit (in seconds) is given, choose_move searches with iterative deepening until the time is up,
+        and depth is the maximal depth (or None for no maximum). Each iteration searches the best moves of the
+        previous one first, using the best moves stored in the transposition table.
+        With workers (and without time_limit), the first move at the root is searched in this process, after which
+        the other moves are searched in parallel with the window that follows from the first one (young brothers wait).
+    '''
+    # The largest batch of leaves that is evaluated at once with a time limit
+    TIMED_BATCH = 16
+
+    def __init__(self, depth=3, freedom_to_value={ 1: 0.1,2: 0.2,3: 0.4,4: 0.5 }, game=None,no_sort = False,table_mb=64,time_limit=None,workers=None,batch=True,lazy=True,inplace=False,
+                 stats=False,stats_file=None,book=None,symmetric=False):
+        super().__init__(depth, freedom_to_value, table_mb=table_mb, workers=workers, batch=batch, inplace=inplace,
+                         stats=stats, stats_file=stats_file, book=book, symmetric=symmetric)
         self.game = game
-        self.shortest_paths = dict(nx.shortest_path_length(game.G))
         self.no_sort = no_sort
+        self.lazy = lazy
+        self.time_limit = time_limit
+        self.deadline = None
+        self.iteration_best = None
+        self.iteration_value = None
+        # A timed search shouldn't spend its time on the symmetries of the board, so they are computed here if possible
+        if symmetric and time_limit is not None and game is not None:
+            game.graph.symmetries()
 
-    def sort_moves(self,node):
+    def move_key(self,node):
         # Sort lexigraphically by distance to last move (if the last move isn't "pass") and degree, 
         # so that high-degree nodes close to the last move are considered first. 
         # This way, when exploring moves, it will more easily encounter " obvious answers" to moves.
-        node.appendAll(verbose=False)
         if self.no_sort:
-            return list(node.childNodes.keys())
+            return None
         last_move = node.last_move()
-        degree_key = lambda move: 0 if move=="pass" else -self.game.G.degree(move)
-        distance_key = lambda move: float('inf') if move=="pass" or last_move=="pass" else self.shortest_paths[last_move][move]
-        
-        key = lambda move: (float("inf"),0) if move=="pass" else (self.shortest_paths[last_move][move],-self.game.G.degree(move))
+        graph = node.game.graph
+        degrees = graph.degrees
         if last_move == "pass":
-            key = lambda move: 0 if move=="pass" else -self.game.G.degree(move)
-        sorted_moves = sorted(node.childNodes.keys(), key=key)
-        return sorted_moves
+            return lambda move: 0 if move=="pass" else -degrees[move]
+        distances = graph.distance_row(last_move).tolist()
+        return lambda move: (float("inf"),0) if move=="pass" else (distances[move],-degrees[move])
+
+    # With a time limit, the depth that is reached depends on the speed of the machine
+    def book_config(self,komi):
+        if self.time_limit is not None:
+            return None
+        return (f'AlphaBeta {self.depth} {sorted(self.freedom_to_value.items())}{" no_sort" if self.no_sort else ""}'
+                f'{" symmetric" if self.symmetric else ""} komi {komi}')
+
+    # The moves are sorted by their distance to the last move, so the chosen move can depend on it
+    def book_key(self,node):
+        key,g = self.table_key(node)
+        if self.no_sort:
+            return key,g
+        last_move = node.game.graph.to_canonical(node.last_move(),g)
+        return key ^ ((0 if last_move=='pass' else last_move+1)*LAST_MOVE_KEY & KEY_MASK),g
+
+    def sort_moves(self,node,first=None,places=None):
+        if places is None:
+            node.appendAll(verbose=False)
+        return list(node.generate_moves(self.move_key(node),first=first,places=places))
+
+    # The legal moves at node in the order in which they are searched; a generator when the search is lazy or in place
+    def ordered_moves(self,node,first=None):
+        places = self.distinct_places(node)
+        if self.lazy or isinstance(node,SearchBoard):
+            return node.generate_moves(self.move_key(node),first=first,places=places)
+        return self.sort_moves(node,first=first,places=places)
+
+    # Yields the moves together with their values as leaves, evaluating the children in batches of increasing size
+    # With a time limit, the batches stay small, since the deadline is only checked between them
+    def iter_leaf_values(self,node,moves):
+        moves = iter(moves)
+        size = 8
+        max_size = 64 if self.time_limit is None else self.TIMED_BATCH
+        while True:
+            self.check_deadline()
+            chunk = list(islice(moves,size))
+            if not chunk:
+                return
+            values = self.evaluate_children(node,chunk)
+            for move in chunk:
+                yield move,values[move]
+            size = min(2*size,max_size)
 
+    def check_deadline(self):
+        if self.deadline is not None and perf_counter()>self.deadline:
+            raise SearchTimeout()
+        self.check_cancelled()
 
     def minimax(self,node,alpha,beta,depth=3):
-        if node.state.ended or depth==0:
+        self.check_deadline()
+        table = self.table
+        stats = self.stats
+        if node.state.ended or (depth==0 and table is None):
             return self.evaluate(node),None
+        first = None
+        if table is not None:
+            graph = node.game.graph
+            key,g = self.table_key(node)
+            entry = table.lookup(key)
+            if entry is not None and self.time_limit is not None:
+                # Search the best move of the previous iteration first
+                first = graph.from_canonical(entry[4],g)
+            if entry is not None and entry[1]==depth:
+                value,flag,move = entry[2:5]
+                move = graph.from_canonical(move,g)
+                if flag==TranspositionTable.EXACT:
+                    return value,move
+                if flag==TranspositionTable.LOWER:
+                    alpha = max(alpha,value)
+                else:
+                    beta = min(beta,value)
+                if beta <= alpha:
+                    return value,move
+            if depth==0:
+                value = self.evaluate(node)
+                table.store(key,depth,value,TranspositionTable.EXACT)
+                return value,None
+            alpha0,beta0 = alpha,beta
+        if stats is not None:
+            stats.nodes += 1
         best_val = float('-inf') if node.turn==BLACK else float('inf')
         best_move = None
+        moves = self.ordered_moves(node,first=first)
+        if depth==1 and self.batch:
+            # Evaluating leaves together is cheaper than evaluating the ones before a cutoff one by one
+            if self.lazy or isinstance(node,SearchBoard):
+                moves = self.iter_leaf_values(node,moves)
+            else:
+                leaf_values = self.evaluate_children(node)
+                moves = ((move,leaf_values[move]) for move in moves)
+        else:
+            moves = ((move,None) for move in moves)
 
-        for move in self.sort_moves(node):
-            child = node.childNodes[move]
-            val = self.minimax(child,alpha,beta,depth=depth-1)[0] # Ignore the move return
+        for move,val in moves:
+            if stats is not None:
+                stats.children += 1
+            if val is None:
+                child = self.enter(node,move)
+                val = self.minimax(child,alpha,beta,depth=depth-1)[0] # Ignore the move return
+                self.leave(child)
             # Update alpha/beta
             if node.turn==BLACK:
                 if val>best_val:
@@ -109,10 +752,212 @@ class AlphaBetaBot(MiniMaxBot):
                     best_move = move
                 beta=min(beta,best_val)
             if beta <= alpha:
+                if stats is not None:
+                    stats.cutoff(depth)
                 break
+        if table is not None:
+            # With fail-soft alpha-beta, a value outside of the window is a bound on the true value
+            if best_val <= alpha0:
+                flag = TranspositionTable.UPPER
+            elif best_val >= beta0:
+                flag = TranspositionTable.LOWER
+            else:
+                flag = TranspositionTable.EXACT
+            table.store(key,depth,best_val,flag,graph.to_canonical(best_move,g))
+        elif stats is not None and best_move is not None:
+            self.remember_best_move(node,best_move)
         return best_val,best_move
     
-    def choose_move(self,node):
+    def search(self,node):
+        if self.table is not None:
+            self.table.new_search()
+        position = self.root(node)
+        if self.time_limit is not None:
+            return self.iterative_deepening(position)
         print("move order:")
-        print(self.sort_moves(node))
-        return self.minimax(node,float('-inf'),float('inf'),depth=self.depth)[1]
+        print(self.root_moves(position))
+        if self.workers is not None:
+            return self.parallel_search(position)
+        self.last_value,move = self.minimax(position,float('-inf'),float('inf'),depth=self.depth)
+        return move
+
+    def root_moves(self,node):
+        places = self.distinct_places(node)
+        if isinstance(node,SearchBoard):
+            return list(node.generate_moves(self.move_key(node),places=places))
+        return self.sort_moves(node,places=places)
+
+    def parallel_search(self,node):
+        moves = self.root_moves(node)
+        if self.stats is not None:
+            self.stats.nodes += 1
+            self.stats.children += len(moves)
+        best_move = moves[0]
+        child = self.enter(node,best_move)
+        best_val = self.minimax(child,float('-inf'),float('inf'),depth=self.depth-1)[0]
+        self.leave(child)
+        alpha,beta = (best_val,float('inf')) if node.turn==BLACK else (float('-inf'),best_val)
+        pool = self.get_pool(node.game)
+        snapshot = node.snapshot()
+        futures = [
+            pool.submit(_search_move,snapshot,move,alpha,beta,self.depth-1)
+            for move in moves[1:]
+        ]
+        # Values inside the window are exact, so taking the first best move gives the same move as the sequential search
+        for move,future in zip(moves[1:],futures):
+            val = future.result()
+            if (node.turn==BLACK and val>best_val) or (node.turn==WHITE and val<best_val):
+                best_val = val
+                best_move = move
+        self.last_value = best_val
+        return best_move
+
+    def iterative_deepening(self,node):
+        # A full garbage collection of a large game tree can take longer than 100ms, which would make us miss the deadline.
+        # The tree has to be kept anyway, so we collect after the search.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        # The symmetries of a new board are computed before the clock starts
+        if self.symmetric:
+            node.game.graph.symmetries()
+        self.deadline = perf_counter()+self.time_limit
+        moves = self.root_moves(node)
+        best_move = moves[0]
+        depth = 1
+        try:
+            while self.depth is None or depth<=self.depth:
+                self.iteration_best = None
+                best_move = self.search_root(node,moves,depth)
+                self.last_value = self.iteration_value
+                if self.stats is not None:
+                    self.stats.completed_depth = depth
+                moves.remove(best_move)
+                moves.insert(0,best_move)
+                depth += 1
+        except SearchTimeout:
+            # The unfinished iteration searched the previous best move first, so any move it prefers is better
+            if self.iteration_best is not None:
+                best_move = self.iteration_best
+                self.last_value = self.iteration_value
+        finally:
+            self.deadline = None
+            if gc_enabled:
+                gc.enable()
+        return best_move
+
+    # Alpha-beta search of the root that remembers its best move so far and its value in iteration_best and iteration_value
+    def search_root(self,node,moves,depth):
+        if self.stats is not None:
+            self.stats.root_depth = depth
+            self.stats.nodes += 1
+        alpha,beta = float('-inf'),float('inf')
+        best_val = float('-inf') if node.turn==BLACK else float('inf')
+        for move in moves:
+            if self.stats is not None:
+                self.stats.children += 1
+            child = self.enter(node,move)
+            val = self.minimax(child,alpha,beta,depth=depth-1)[0]
+            self.leave(child)
+            if node.turn==BLACK and val>best_val:
+                best_val = val
+                self.iteration_best,self.iteration_value = move,val
+                alpha = best_val
+            elif node.turn==WHITE and val<best_val:
+                best_val = val
+                self.iteration_best,self.iteration_value = move,val
+                beta = best_val
+        return self.iteration_best
+
+class MCTSNode:
+    __slots__ = ('move','parent','children','untried','visits','wins')
+
+    # wins counts the playouts won by the player that played move
+    def __init__(self,move,parent,untried):
+        self.move = move
+        self.parent = parent
+        self.children = []
+        self.untried = untried
+        self.visits = 0
+        self.wins = 0
+
+class MCTSBot(Bot):
+    '''
+        Monte Carlo tree search with UCT. Each iteration descends the tree to a node that has untried moves, adds a child
+        for one of them and finishes the game with random moves on a PlayoutBoard.
+        The search stops after the given number of playouts (at least one), or when time_limit (in seconds) is over.
+        The moves at the root are checked by the game (including the Ko rule); below the root only simple Ko is checked.
+    '''
+    def __init__(self,playouts=1000,time_limit=None,exploration=1.0,seed=None):
+        super().__init__()
+        self.playouts = playouts
+        self.time_limit = time_limit
+        self.exploration = exploration
+        self.rng = random.Random(seed)
+
+    def select(self,node):
+        log_visits = math.log(node.visits)
+        exploration = self.exploration
+        return max(node.children,key=lambda child: child.wins/child.visits+exploration*math.sqrt(log_visits/child.visits))
+
+    def choose_move(self,node):
+        game = node.game
+        state = node.state
+        board = PlayoutBoard(game.graph.neighbors,state.board,state._captures,node.turn,game.komi,passed=state.passed)
+        moves = [move for move in node.generate_moves() if move=='pass' or not board.is_eye(move)]
+        if len(moves)==1:
+            return moves[0]
+        root = MCTSNode(None,None,moves)
+        rng = self.rng
+        max_moves = 3*len(board.board)
+        deadline = None if self.time_limit is None else perf_counter()+self.time_limit
+        playouts = 0
+        # At least one playout is played, so that the root has a child to choose
+        while playouts==0 or ((deadline is None or perf_counter()<deadline) and (self.playouts is None or playouts<self.playouts)):
+            self.check_cancelled()
+            current = root
+            position = board.copy()
+            while not current.untried and current.children:
+                current = self.select(current)
+                position.play(current.move)
+            if current.untried and not position.ended():
+                move = current.untried.pop(int(rng.random()*len(current.untried)))
+                player = position.turn
+                position.play(move)
+                child = MCTSNode(move,current,[] if position.ended() else position.legal_moves())
+                current.children.append(child)
+                current = child
+            else:
+                player = 1-position.turn
+            score = position.playout(rng,max_moves)
+            # The player that made the move into current, and then the players above it alternately
+            won = (score>0)==(player==BLACK)
+            while current is not None:
+                current.visits += 1
+                if won:
+                    current.wins += 1
+                won = not won
+                current = current.parent
+            playouts += 1
+        print({child.move: (child.wins,child.visits) for child in root.children})
+        return max(root.children,key=lambda child: child.visits).move
+
+'''
+    Creates a bot from a description like "MiniMax 3", "AlphaBeta 3", "AlphaBeta 2.5s" (a time limit in seconds),
+    "MCTS 1000" (a number of playouts) or "MCTS 2.5s". MiniMax and AlphaBeta bots use the symmetries of the board
+    when the description ends with "symmetric", like "AlphaBeta 3 symmetric".
+'''
+# table_mb caps the transposition tables of the MiniMax and AlphaBeta bots, seed seeds the random moves of MCTS bots
+def make_bot(description,game,table_mb=64,book=None,seed=None):
+    words = description.split(" ")
+    symmetric = words[-1]=="symmetric"
+    if words[0]=="MiniMax":
+        return MiniMaxBot(depth=int(words[1]),table_mb=table_mb,book=book,symmetric=symmetric)
+    if words[0]=="AlphaBeta":
+        if words[1].endswith("s"):
+            return AlphaBetaBot(depth=None,game=game,time_limit=float(words[1][:-1]),table_mb=table_mb,symmetric=symmetric)
+        return AlphaBetaBot(depth=int(words[1]),game=game,table_mb=table_mb,book=book,symmetric=symmetric)
+    if words[0]=="MCTS":
+        if words[1].endswith("s"):
+            return MCTSBot(playouts=None,time_limit=float(words[1][:-1]),seed=seed)
+        return MCTSBot(playouts=int(words[1]),seed=seed)
+    raise Exception(f"Unknown player {description}")
@@ -1,9 +1,16 @@
 import networkx as nx
-import matplotlib.pyplot as plt
+import hashlib
+from array import array
+import random
+from collections import OrderedDict,deque
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components,shortest_path
 #from networks import generate_grid,usa_network
 
-from enum import Enum
-class Status(Enum):
+from enum import IntEnum
+# Statuses are ints, so that boards can be stored as int8 arrays and compared directly to EMPTY, BLACK and WHITE
+class Status(IntEnum):
     EMPTY = -1
     BLACK = 0
     WHITE = 1
@@ -30,6 +37,9 @@ class Status(Enum):
         if self==WHITE:
             return 'White'
         
+    def __format__(self,spec):
+        return str(self).__format__(spec)
+
     def __int__(self):
         if self==EMPTY:
             return -1
@@ -112,45 +122,977 @@ def compute_territory(gg):
         if len(neigh_statuses)==1 and EMPTY not in neigh_statuses:
             territory[neigh_statuses.pop()]+=gg.nodes[i]['size']
     return territory
-         
+
+
+class GroupIndex:
+    '''
+        Keeps track of the groups of stones on the board and their liberties, so that we don't have to rebuild
+        the group graph after every move. Groups are stored in a union-find structure: parent[i] is None for empty
+        places, and the root of each group holds its color, its stones and its liberties.
+        neighbors[i] should be an iterable of the places adjacent to place i.
+    '''
+    def __init__(self,neighbors):
+        self.neighbors = neighbors
+        self.parent = [None]*len(neighbors)
+        self.color = {}
+        self.stones = {}
+        self.liberties = {}
+
+    def find(self,i):
+        parent = self.parent
+        root = parent[i]
+        if root is None or root==i:
+            return root
+        while parent[root]!=root:
+            root = parent[root]
+        # Path compression
+        while parent[i]!=root:
+            parent[i],i = root,parent[i]
+        return root
+
+    def group(self,i):
+        root = self.find(i)
+        return set() if root is None else self.stones[root]
+
+    def group_liberties(self,i):
+        root = self.find(i)
+        return set() if root is None else self.liberties[root]
+
+    '''
+        Returns the stones that would be captured when color plays at the (empty) place move, together with
+        a boolean that indicates whether the move would be suicide. Does not modify the index.
+    '''
+    def compute_captures(self,move,color):
+        captures = []
+        has_liberty = False
+        seen = set()
+        for j in self.neighbors[move]:
+            root = self.find(j)
+            if root is None:
+                has_liberty = True
+            elif root in seen:
+                continue
+            elif self.color[root]==color:
+                # Our own group keeps a liberty if it has another one besides move
+                has_liberty = has_liberty or len(self.liberties[root])>1
+            elif len(self.liberties[root])==1:
+                # move is the last liberty of this neighboring enemy group
+                captures += self.stones[root]
+            seen.add(root)
+        return captures, not captures and not has_liberty
+
+    '''
+        Places a stone of the given color at move, merges it with the neighboring groups of the same color and
+        removes the enemy groups that lost their last liberty. Returns the list of captured stones.
+    '''
+    def place(self,move,color):
+        parent = self.parent
+        parent[move] = move
+        self.color[move] = color
+        self.stones[move] = {move}
+        self.liberties[move] = {j for j in self.neighbors[move] if parent[j] is None}
+        root = move
+        captured_roots = []
+        for j in self.neighbors[move]:
+            other = self.find(j)
+            if other is None or other==root:
+                continue
+            if self.color[other]==color:
+                root = self._union(root,other)
+            else:
+                liberties = self.liberties[other]
+                liberties.discard(move)
+                if not liberties and other not in captured_roots:
+                    captured_roots.append(other)
+        self.liberties[root].discard(move)
+        captures = []
+        for other in captured_roots:
+            captures += self._remove(other)
+        return captures
+
+    def _union(self,a,b):
+        if len(self.stones[a])<len(self.stones[b]):
+            a,b = b,a
+        self.parent[b] = a
+        self.stones[a] |= self.stones.pop(b)
+        self.liberties[a] |= self.liberties.pop(b)
+        del self.color[b]
+        return a
+
+    # Removes the group with the given root from the board and gives its places back as liberties to its neighbors
+    def _remove(self,root):
+        stones = self.stones.pop(root)
+        del self.liberties[root]
+        del self.color[root]
+        for i in stones:
+            self.parent[i] = None
+        for i in stones:
+            for j in self.neighbors[i]:
+                other = self.find(j)
+                if other is not None:
+                    self.liberties[other].add(i)
+        return list(stones)
+
+
+class TerritoryIndex:
+    '''
+        Keeps track of the empty regions of the board and, for each region, the number of edges between the region and
+        black and white stones, so that the territory is known after every move without recomputing the groups.
+        A region is territory of a color when it borders stones of that color only. region[i] is the region of the
+        empty place i (None for stones), and territory has the current territory of black and white.
+        A stone can split its region in pieces. These are searched from the empty neighbors of the stone at the same
+        time, and the search stops when all pieces but one are complete, so that only the smaller pieces are relabeled.
+    '''
+    def __init__(self,neighbors,board):
+        self.neighbors = neighbors
+        self.status = list(board)
+        self.region = [None]*len(self.status)
+        self.members = {}
+        self.edges = {}
+        self.territory = {BLACK: 0, WHITE: 0}
+        self.next_region = 0
+        for i,s in enumerate(self.status):
+            if s==EMPTY and self.region[i] is None:
+                places = [i]
+                self.region[i] = -1
+                for j in places:
+                    for k in neighbors[j]:
+                        if self.status[k]==EMPTY and self.region[k] is None:
+                            self.region[k] = -1
+                            places.append(k)
+                self._tally(self._new_region(places),1)
+
+    # Adds a region with the given places and counts its edges to stones
+    def _new_region(self,places):
+        r = self.next_region
+        self.next_region += 1
+        edges = [0,0]
+        status = self.status
+        for i in places:
+            self.region[i] = r
+            for j in self.neighbors[i]:
+                if status[j]!=EMPTY:
+                    edges[status[j]] += 1
+        self.members[r] = set(places)
+        self.edges[r] = edges
+        return r
+
+    def owner(self,r):
+        black,white = self.edges[r]
+        if black and not white:
+            return BLACK
+        if white and not black:
+            return WHITE
+
+    # Adds (sign=1) or removes (sign=-1) the region from the territory of its owner
+    def _tally(self,r,sign):
+        owner = self.owner(r)
+        if owner is not None:
+            self.territory[owner] += sign*len(self.members[r])
+
+    # Places a stone of color at move and removes the captured stones
+    def place(self,move,color,captures=()):
+        status = self.status
+        r = self.region[move]
+        self._tally(r,-1)
+        status[move] = color
+        self.region[move] = None
+        members = self.members[r]
+        members.discard(move)
+        edges = self.edges[r]
+        seeds = []
+        for j in self.neighbors[move]:
+            if status[j]==EMPTY:
+                seeds.append(j)
+            else:
+                # The edge to the stone at j belonged to the place move
+                edges[status[j]] -= 1
+        # The new stone borders the pieces of the region through the edges to its empty neighbors
+        edges[color] += len(seeds)
+        if members:
+            for piece in self._split(r,seeds):
+                self._tally(piece,1)
+            self._tally(r,1)
+        else:
+            del self.members[r]
+            del self.edges[r]
+        for i in captures:
+            self._empty(i)
+
+    '''
+        Splits the pieces of region r that are no longer connected after a stone is placed next to the seeds, and returns the
+        new regions. r keeps the largest piece (or the one whose search didn't finish).
+    '''
+    def _split(self,r,seeds):
+        if len(seeds)<=1:
+            return []
+        status = self.status
+        neighbors = self.neighbors
+        label = {}
+        parent = {}
+        queues = {}
+        visited = {}
+        for s in seeds:
+            if s not in label:
+                label[s] = s
+                parent[s] = s
+                queues[s] = deque([s])
+                visited[s] = [s]
+        finished = []
+        while len(queues)>1:
+            for root in list(queues):
+                if root not in queues:
+                    continue
+                queue = queues[root]
+                if not queue:
+                    del queues[root]
+                    finished.append(root)
+                    if len(queues)<=1:
+                        break
+                    continue
+                i = queue.popleft()
+                for j in neighbors[i]:
+                    if status[j]!=EMPTY:
+                        continue
+                    other = label.get(j)
+                    if other is None:
+                        label[j] = root
+                        visited[root].append(j)
+                        queue.append(j)
+                        continue
+                    while parent[other]!=other:
+                        other = parent[other]
+                    if other!=root:
+                        # The searches met, so they are in the same piece
+                        if len(visited[root])<len(visited[other]):
+                            root,other = other,root
+                        parent[other] = root
+                        queues[root].extend(queues.pop(other))
+                        visited[root] += visited.pop(other)
+                        queue = queues[root]
+                if len(queues)<=1:
+                    break
+        if not queues:
+            # All searches finished, so r keeps the largest piece
+            finished.sort(key=lambda root: len(visited[root]))
+            finished.pop()
+        pieces = []
+        for root in finished:
+            piece = self._new_region(visited[root])
+            self.members[r] -= self.members[piece]
+            black,white = self.edges[piece]
+            self.edges[r][0] -= black
+            self.edges[r][1] -= white
+            pieces.append(piece)
+        return pieces
+
+    # Removes the captured stone at i, which joins the regions around it
+    def _empty(self,i):
+        status = self.status
+        region = self.region
+        color = status[i]
+        touched = {region[j] for j in self.neighbors[i] if status[j]==EMPTY}
+        for other in touched:
+            self._tally(other,-1)
+        status[i] = EMPTY
+        for j in self.neighbors[i]:
+            if status[j]==EMPTY:
+                self.edges[region[j]][color] -= 1
+        r = self._new_region([i])
+        for other in touched:
+            r = self._merge(r,other)
+        self._tally(r,1)
+
+    # Merges two regions into the larger one and returns it
+    def _merge(self,a,b):
+        if len(self.members[a])<len(self.members[b]):
+            a,b = b,a
+        members = self.members.pop(b)
+        for i in members:
+            self.region[i] = a
+        self.members[a] |= members
+        black,white = self.edges.pop(b)
+        self.edges[a][0] += black
+        self.edges[a][1] += white
+        return a
+
+
+class PlayoutBoard:
+    '''
+        A board for fast random playouts, which are played on plain lists without creating game nodes or states.
+        Groups are tracked with pseudo-liberties: libs[g] counts the pairs of a stone of group g and an empty neighbor,
+        so a group is captured when this becomes 0, and m is the last liberty of g exactly when all of its
+        pseudo-liberties are adjacent to m. Only simple Ko is checked, so a playout stops after max_moves moves.
+        neighbors[i] should be the tuple of places adjacent to place i.
+    '''
+    def __init__(self,neighbors,board,captures,turn,komi,passed=False):
+        n = len(neighbors)
+        self.neighbors = neighbors
+        self.board = [int(s) for s in board]
+        self.group = [-1]*n # The representative stone of the group of each place, or -1 for empty places
+        self.stones = [None]*n # The stones of each group, at the index of its representative
+        self.libs = [0]*n
+        self.empties = []
+        self.where = [-1]*n # The index of each empty place in empties
+        self.captures = list(captures)
+        self.turn = int(turn)
+        self.komi = komi
+        self.passes = 1 if passed else 0
+        self.ko = -1
+        board = self.board
+        for i,s in enumerate(board):
+            if s==EMPTY:
+                self.where[i] = len(self.empties)
+                self.empties.append(i)
+            elif self.group[i]==-1:
+                stones = [i]
+                self.group[i] = i
+                for j in stones:
+                    for k in neighbors[j]:
+                        if board[k]==EMPTY:
+                            self.libs[i] += 1
+                        elif board[k]==s and self.group[k]==-1:
+                            self.group[k] = i
+                            stones.append(k)
+                self.stones[i] = stones
+
+    def copy(self):
+        other = PlayoutBoard.__new__(PlayoutBoard)
+        other.__dict__.update(self.__dict__)
+        other.board = self.board[:]
+        other.group = self.group[:]
+        other.stones = [None if stones is None else stones[:] for stones in self.stones]
+        other.libs = self.libs[:]
+        other.empties = self.empties[:]
+        other.where = self.where[:]
+        other.captures = self.captures[:]
+        return other
+
+    def ended(self):
+        return self.passes>=2
+
+    # Whether the player to move may play at the empty place m (without checking for repeated boards other than simple Ko)
+    def is_legal(self,m):
+        if m==self.ko:
+            return False
+        board = self.board
+        neighbors = self.neighbors[m]
+        for j in neighbors:
+            if board[j]==EMPTY:
+                return True
+        group = self.group
+        for j in neighbors:
+            g = group[j]
+            adjacent = 0
+            for k in neighbors:
+                if group[k]==g:
+                    adjacent += 1
+            if board[j]==self.turn:
+                if self.libs[g]>adjacent:
+                    return True
+            elif self.libs[g]==adjacent:
+                return True
+        return False
+
+    # Whether m is surrounded by stones of the player to move, in which case random playouts don't fill it
+    def is_eye(self,m):
+        board = self.board
+        neighbors = self.neighbors[m]
+        if not neighbors:
+            return True
+        for j in neighbors:
+            if board[j]!=self.turn:
+                return False
+        return True
+
+    # The legal moves that don't fill an eye of the player to move, and pass
+    def legal_moves(self):
+        return [m for m in self.empties if not self.is_eye(m) and self.is_legal(m)]+['pass']
+
+    # Plays m (or pass) for the player to move and returns the captured stones
+    def play(self,m):
+        color = self.turn
+        self.turn = 1-color
+        if m=='pass':
+            self.passes += 1
+            self.ko = -1
+            return []
+        self.passes = 0
+        board = self.board
+        group = self.group
+        stones = self.stones
+        libs = self.libs
+        neighbors = self.neighbors[m]
+        self._take(m)
+        board[m] = color
+        group[m] = m
+        stones[m] = [m]
+        own = 0
+        for j in neighbors:
+            if board[j]==EMPTY:
+                own += 1
+            else:
+                libs[group[j]] -= 1
+        libs[m] = own
+        g = m
+        captured = []
+        for j in neighbors:
+            s = board[j]
+            if s==color:
+                if group[j]!=g:
+                    g = self._merge(g,group[j])
+            elif s!=EMPTY and libs[group[j]]==0:
+                captured += self._remove(group[j])
+        self.captures[color] += len(captured)
+        # After taking a single stone with a single stone, the opponent may not take back immediately
+        self.ko = captured[0] if len(captured)==1 and len(stones[g])==1 and libs[g]==1 else -1
+        return captured
+
+    def _take(self,m):
+        empties = self.empties
+        where = self.where
+        last = empties.pop()
+        if last!=m:
+            empties[where[m]] = last
+            where[last] = where[m]
+        where[m] = -1
+
+    def _merge(self,g,h):
+        stones = self.stones
+        if len(stones[g])<len(stones[h]):
+            g,h = h,g
+        group = self.group
+        for i in stones[h]:
+            group[i] = g
+        stones[g] += stones[h]
+        stones[h] = None
+        self.libs[g] += self.libs[h]
+        return g
+
+    def _remove(self,g):
+        board = self.board
+        group = self.group
+        libs = self.libs
+        stones = self.stones[g]
+        self.stones[g] = None
+        for i in stones:
+            board[i] = EMPTY
+            group[i] = -1
+            self.where[i] = len(self.empties)
+            self.empties.append(i)
+        for i in stones:
+            for k in self.neighbors[i]:
+                if board[k]!=EMPTY:
+                    libs[group[k]] += 1
+        return stones
+
+    # A random legal move that doesn't fill an eye of the player to move, or pass if there is none
+    def random_move(self,rng):
+        empties = self.empties
+        count = len(empties)
+        if not count:
+            return 'pass'
+        board = self.board
+        neighbors = self.neighbors
+        turn = self.turn
+        start = int(rng.random()*count)
+        for t in range(count):
+            m = empties[start+t-count] # Negative indices wrap around
+            eye = True
+            for j in neighbors[m]:
+                s = board[j]
+                if s==EMPTY:
+                    # A place with an empty neighbor is legal and not an eye
+                    if m!=self.ko:
+                        return m
+                    eye = False
+                    break
+                if s!=turn:
+                    eye = False
+            if not eye and neighbors[m] and self.is_legal(m):
+                return m
+        return 'pass'
+
+    # Plays random moves until both players pass or max_moves moves are played, and returns the score
+    def playout(self,rng,max_moves):
+        moves = 0
+        while self.passes<2 and moves<max_moves:
+            self.play(self.random_move(rng))
+            moves += 1
+        return self.score()
+
+    # Captures and territory of black minus those of white and the komi, as in GoGame.compute_score
+    def score(self):
+        board = self.board
+        neighbors = self.neighbors
+        score = self.captures[BLACK]-self.captures[WHITE]-self.komi
+        seen = set()
+        for i in self.empties:
+            if i in seen:
+                continue
+            seen.add(i)
+            region = [i]
+            borders = set()
+            for j in region:
+                for k in neighbors[j]:
+                    s = board[k]
+                    if s!=EMPTY:
+                        borders.add(s)
+                    elif k not in seen:
+                        seen.add(k)
+                        region.append(k)
+            if borders=={BLACK}:
+                score += len(region)
+            elif borders=={WHITE}:
+                score -= len(region)
+        return score
+
+
+class BoardGraph:
+    '''
+        Compact representation of the board topology: the neighbors of place i are indices[indptr[i]:indptr[i+1]].
+        The game is played on int8 arrays of statuses. The neighbor tuples are kept next to the CSR arrays because
+        indexing numpy arrays one element at a time is slow in Python loops.
+        Boards are cached by their fingerprint (see Cached), so that the games and bots on the same topology share
+        the Zobrist keys and the distances between places, which are computed when they are first needed.
+    '''
+    # Boards with at most this many places get a full distance matrix, for larger boards we keep the last DISTANCE_ROWS rows
+    MAX_DISTANCE_MATRIX = 4096
+    DISTANCE_ROWS = 1024
+    # Larger symmetry groups (and the symmetries of boards with more places) are not used, see automorphisms
+    MAX_AUTOMORPHISMS = 1024
+    MAX_SYMMETRY_PLACES = 1024
+    UNREACHABLE = np.iinfo(np.uint16).max
+    CACHE_SIZE = 32
+    cache = OrderedDict()
+
+    def __init__(self,n,edges):
+        self.n = n
+        self.edges = np.asarray(edges,dtype=np.int32).reshape(-1,2)
+        self.fingerprint = BoardGraph.Fingerprint(n,self.edges)
+        sources = np.concatenate([self.edges[:,0],self.edges[:,1]])
+        targets = np.concatenate([self.edges[:,1],self.edges[:,0]])
+        order = np.lexsort((targets,sources))
+        self.sources = sources[order]
+        self.indices = targets[order]
+        self.indptr = np.zeros(n+1,dtype=np.int32)
+        np.cumsum(np.bincount(self.sources,minlength=n),out=self.indptr[1:])
+        self.degree = np.diff(self.indptr)
+        indices = self.indices.tolist()
+        indptr = self.indptr.tolist()
+        self.neighbors = [tuple(indices[indptr[i]:indptr[i+1]]) for i in range(n)]
+        # Zobrist keys: zobrist[color][i] is xor-ed into the hash of a board when place i has a stone of that color.
+        # We use a fixed seed so that hashes of the same board agree between processes.
+        rng = random.Random(0)
+        self.zobrist = [[rng.getrandbits(64) for _ in range(n)] for color in (BLACK,WHITE)]
+        self.degrees = self.degree.tolist()
+        self._distances = None
+        self._distance_rows = OrderedDict()
+        self._automorphisms = None
+
+    # A hash of the number of places and the sorted edges, which is the same for the same graph with the same numbering
+    @staticmethod
+    def Fingerprint(n,edges):
+        edges = np.sort(np.asarray(edges,dtype=np.int64).reshape(-1,2),axis=1)
+        edges = edges[np.lexsort((edges[:,1],edges[:,0]))]
+        return hashlib.blake2b(np.int64(n).tobytes()+edges.tobytes(),digest_size=16).hexdigest()
+
+    # Returns the cached board with the same fingerprint, or creates it. The CACHE_SIZE most recently used boards are kept.
+    @classmethod
+    def Cached(cls,n,edges):
+        fingerprint = cls.Fingerprint(n,edges)
+        if fingerprint in cls.cache:
+            cls.cache.move_to_end(fingerprint)
+            return cls.cache[fingerprint]
+        graph = cls(n,edges)
+        cls.cache[fingerprint] = graph
+        if len(cls.cache)>cls.CACHE_SIZE:
+            cls.cache.popitem(last=False)
+        return graph
+
+    @classmethod
+    def FromNetworkx(cls,G):
+        name2idx = {name: i for i,name in enumerate(G)}
+        return cls.Cached(len(name2idx),[(name2idx[n1],name2idx[n2]) for n1,n2 in G.edges])
+
+    # Only the edges are sent to other processes, which take the board from their own cache (or build it there)
+    def __reduce__(self):
+        return BoardGraph.Cached,(self.n,self.edges)
+
+    def adjacency(self):
+        return csr_matrix((np.ones(len(self.indices),dtype=np.int8),self.indices,self.indptr),shape=(self.n,self.n))
+
+    # Breadth first search from the given places, as a uint16 array with a row per place (UNREACHABLE for other components)
+    def _bfs(self,indices):
+        distances = shortest_path(self.adjacency(),unweighted=True,indices=indices)
+        distances[np.isinf(distances)] = self.UNREACHABLE
+        return distances.astype(np.uint16)
+
+    # The (n,n) uint16 matrix of distances between places. Only for boards with at most MAX_DISTANCE_MATRIX places.
+    def distance_matrix(self):
+        if self._distances is None:
+            if self.n>self.MAX_DISTANCE_MATRIX:
+                raise Exception(f"A board with {self.n} places is too large for a distance matrix")
+            # Rows are computed in blocks to avoid a float matrix of the full size
+            self._distances = np.concatenate([
+                self._bfs(np.arange(start,min(start+256,self.n)))
+                for start in range(0,self.n,256)
+            ]) if self.n else np.zeros((0,0),dtype=np.uint16)
+        return self._distances
+
+    # The distances from place i to all places
+    def distance_row(self,i):
+        if self.n<=self.MAX_DISTANCE_MATRIX:
+            return self.distance_matrix()[i]
+        rows = self._distance_rows
+        if i in rows:
+            rows.move_to_end(i)
+        else:
+            rows[i] = self._bfs(i)
+            if len(rows)>self.DISTANCE_ROWS:
+                rows.popitem(last=False)
+        return rows[i]
+
+    # The places at distance at most k from place i (including i itself)
+    def neighborhood(self,i,k):
+        return np.flatnonzero(self.distance_row(i)<=k)
+
+    def zobrist_hash(self,board):
+        zobrist = self.zobrist
+        h = 0
+        for i,s in enumerate(board):
+            if s!=EMPTY:
+                h ^= zobrist[s][i]
+        return h
+
+    # Updates the hash h for color playing at move and capturing the stones in captures
+    def zobrist_move(self,h,move,color,captures):
+        h ^= self.zobrist[color][move]
+        keys = self.zobrist[1-color]
+        for i in captures:
+            h ^= keys[i]
+        return h
+
+    '''
+        Refines colors of the places by the colors of their neighbors until the number of colors is stable. The new
+        colors only depend on the old ones, so an automorphism that keeps the old colors keeps the new ones. When the
+        signatures of each round are recorded in trace, refining another coloring with that trace returns None as soon
+        as its signatures differ, since no automorphism can then map the colorings to each other.
+    '''
+    def _refine(self,colors,trace):
+        neighbors = self.neighbors
+        replay = len(trace)>0
+        count = len(set(colors))
+        for round in range(self.n+1):
+            signatures = [(colors[i],tuple(sorted([colors[j] for j in neighbors[i]]))) for i in range(self.n)]
+            distinct = sorted(set(signatures))
+            if replay:
+                if round>=len(trace) or distinct!=trace[round]:
+                    return None
+            else:
+                trace.append(distinct)
+            ids = {signature: c for c,signature in enumerate(distinct)}
+            colors = [ids[signature] for signature in signatures]
+            if len(distinct)==count:
+                return colors
+            count = len(distinct)
+
+    # Adds the automorphisms that map the coloring a to the coloring b to found, fixing one place at a time
+    def _match(self,a,b,found):
+        cells = {}
+        for i,c in enumerate(a):
+            cells.setdefault(c,[]).append(i)
+        cell = min((cell for cell in cells.values() if len(cell)>1),key=len,default=None)
+        if cell is None:
+            image = {c: i for i,c in enumerate(b)}
+            perm = [image[c] for c in a]
+            if all(perm[j] in self.neighbors[perm[i]] for i,j in self.edges.tolist()):
+                found.append(perm)
+            return
+        v = cell[0]
+        trace = []
+        fixed = a[:]
+        fixed[v] = len(cells)
+        fixed = self._refine(fixed,trace)
+        for u in [i for i,c in enumerate(b) if c==a[v]]:
+            if len(found)>self.MAX_AUTOMORPHISMS:
+                return
+            mapped = b[:]
+            mapped[u] = len(cells)
+            mapped = self._refine(mapped,trace)
+            if mapped is not None:
+                self._match(fixed,mapped,found)
+
+    '''
+        The automorphisms of the board as a (k,n) int32 array, with the identity first: symmetry g moves place i to
+        perms[g][i]. They are computed once per topology, by refining the degrees of the places and fixing the image of
+        one place at a time. Boards with more than MAX_SYMMETRY_PLACES places or more than MAX_AUTOMORPHISMS symmetries
+        only get the identity, so that they are searched as before.
+    '''
+    def automorphisms(self):
+        if self._automorphisms is None:
+            identity = np.arange(self.n,dtype=np.int32)[None]
+            perms = identity
+            if 0<self.n<=self.MAX_SYMMETRY_PLACES:
+                colors = self._refine(self.degrees,[])
+                found = []
+                if len(set(colors))<self.n:
+                    self._match(colors,colors,found)
+                if 1<len(found)<=self.MAX_AUTOMORPHISMS:
+                    perms = np.array(found,dtype=np.int32)
+                    perms = np.concatenate([identity,perms[(perms!=identity).any(axis=1)]])
+            inverse = np.empty_like(perms)
+            np.put_along_axis(inverse,perms,identity.repeat(len(perms),axis=0),axis=1)
+            # keys[color][g][i] is the Zobrist key of a stone of color at place i after symmetry g
+            keys = np.array(self.zobrist,dtype=np.uint64).reshape(2,self.n)[:,perms]
+            self._automorphisms = (perms,inverse,keys)
+        return self._automorphisms[0]
+
+    def symmetries(self):
+        return len(self.automorphisms())
+
+    # The Zobrist hashes of the images of board under all automorphisms
+    def symmetric_hashes(self,board):
+        self.automorphisms()
+        keys = self._automorphisms[2]
+        b = np.frombuffer(board,dtype=np.int8)
+        return (np.bitwise_xor.reduce(keys[BLACK][:,b==BLACK],axis=1)
+                ^ np.bitwise_xor.reduce(keys[WHITE][:,b==WHITE],axis=1))
+
+    # The smallest hash of the images of board, which is the same for symmetric boards, and the symmetry that gives it
+    def canonical_hash(self,board):
+        hashes = self.symmetric_hashes(board)
+        g = int(hashes.argmin())
+        return int(hashes[g]),g
+
+    # Moves of a board in the numbering of its image under symmetry g, and back
+    def to_canonical(self,move,g):
+        if move is None or move=='pass' or g==0:
+            return move
+        return int(self._automorphisms[0][g][move])
+
+    def from_canonical(self,move,g):
+        if move is None or move=='pass' or g==0:
+            return move
+        return int(self._automorphisms[1][g][move])
+
+    '''
+        One empty place of every class of empty places that the symmetries of board map to each other, or None when only
+        the identity maps board to itself. Moves at places of the same class lead to symmetric boards.
+    '''
+    def distinct_places(self,board):
+        perms = self.automorphisms()
+        if len(perms)==1:
+            return None
+        b = np.frombuffer(board,dtype=np.int8)
+        stabilizer = perms[(b[perms]==b).all(axis=1)]
+        if len(stabilizer)==1:
+            return None
+        representatives = stabilizer.min(axis=0)
+        return np.flatnonzero((b==EMPTY) & (representatives==np.arange(self.n))).tolist()
+
+    '''
+        Returns the group of start and whether it has a liberty. Empty places equal to ignore are not counted
+        as liberties. The search stops as soon as a liberty is found, so the group is only complete when the
+        group has no liberties.
+    '''
+    def flood(self,board,start,ignore=None):
+        neighbors = self.neighbors
+        color = board[start]
+        group = [start]
+        seen = {start}
+        for i in group:
+            for j in neighbors[i]:
+                s = board[j]
+                if s==EMPTY:
+                    if j!=ignore:
+                        return group,True
+                elif s==color and j not in seen:
+                    seen.add(j)
+                    group.append(j)
+        return group,False
+
+    '''
+        Returns the stones that are captured when color plays at the empty place move of board, and whether
+        the move is suicide. Only the groups that neighbor move are visited.
+    '''
+    def compute_captures(self,board,move,color):
+        captures = []
+        has_liberty = False
+        seen = set()
+        for j in self.neighbors[move]:
+            s = board[j]
+            if s==EMPTY:
+                has_liberty = True
+                continue
+            if j in seen:
+                continue
+            group,liberty = self.flood(board,j,ignore=move)
+            if s==color:
+                has_liberty = has_liberty or liberty
+            elif not liberty:
+                captures += group
+                seen.update(group)
+        return captures, not captures and not has_liberty
+
+    '''
+        Computes the groups of a board (an int8 array) and returns a BoardGroups object.
+    '''
+    def groups(self,board):
+        return self.batch_groups(np.asarray(board,dtype=np.int8)[None,:])
+
+    '''
+        Computes the groups of N boards at once, given as an (N,n) int8 array. We label the places of board b by
+        b*n,...,b*n+n-1, so that the boards are the diagonal blocks of one big adjacency matrix.
+    '''
+    def batch_groups(self,boards):
+        boards = np.asarray(boards,dtype=np.int8)
+        n_boards = len(boards)
+        size = n_boards*self.n
+        offsets = np.repeat(np.arange(n_boards,dtype=np.int32)*self.n,len(self.sources))
+        sources = np.tile(self.sources,n_boards)+offsets
+        indices = np.tile(self.indices,n_boards)+offsets
+        flat = boards.ravel()
+        same = flat[sources]==flat[indices]
+        indptr = np.zeros(size+1,dtype=np.int32)
+        np.cumsum(np.bincount(sources[same],minlength=size),out=indptr[1:])
+        adjacency = csr_matrix((np.ones(same.sum(),dtype=np.int8),indices[same],indptr),shape=(size,size))
+        n_groups,labels = connected_components(adjacency,directed=False)
+        return BoardGroups(flat,sources,indices,n_groups,labels,n_boards)
+
+
+class BoardGroups:
+    '''
+        The groups of one or more boards, as computed by BoardGraph.batch_groups. Group g consists of the places
+        with labels==g and lies on board board_of[g].
+        Stones of different colors are never adjacent in the group graph, so we only consider the edges between
+        an empty place and a stone: liberty_edges counts these edges for each group (like the degree in the
+        group graph) and regions counts the distinct empty groups that a stone group borders.
+    '''
+    def __init__(self,board,sources,indices,n_groups,labels,n_boards=1):
+        self.n_groups = n_groups
+        self.n_boards = n_boards
+        self.labels = labels
+        self.status = np.empty(n_groups,dtype=np.int8)
+        self.status[labels] = board
+        self.board_of = np.empty(n_groups,dtype=np.int64)
+        self.board_of[labels] = np.arange(len(board))*n_boards//len(board)
+        self.size = np.bincount(labels,minlength=n_groups)
+        border = (board[sources]==EMPTY) & (board[indices]!=EMPTY)
+        empty_labels = labels[sources[border]]
+        stone_labels = labels[indices[border]]
+        self.liberty_edges = np.bincount(stone_labels,minlength=n_groups)
+        pairs = np.unique(stone_labels.astype(np.int64)*n_groups+empty_labels)
+        self.regions = np.bincount(pairs//n_groups,minlength=n_groups)
+        # Whether an empty group borders black or white stones
+        black = board[indices[border]]==BLACK
+        self.borders_black = np.bincount(empty_labels[black],minlength=n_groups)>0
+        self.borders_white = np.bincount(empty_labels[~black],minlength=n_groups)>0
+
+    # Arrays with the territory of black and white on each board
+    def territories(self):
+        empty = self.status==EMPTY
+        black = empty & self.borders_black & ~self.borders_white
+        white = empty & self.borders_white & ~self.borders_black
+        return (
+            np.bincount(self.board_of[black],weights=self.size[black],minlength=self.n_boards).astype(np.int64),
+            np.bincount(self.board_of[white],weights=self.size[white],minlength=self.n_boards).astype(np.int64),
+        )
+
+    def territory(self):
+        black,white = self.territories()
+        return {
+            BLACK: int(black.sum()),
+            WHITE: int(white.sum()),
+        }
+
 
 class GoGame:
-    def __init__(self,G,komi=3.5,pos=None):
-        newG = nx.Graph()
-        # We want a graph with indices 0,...,n-1, and set each status to 'empty'
-        newG.add_nodes_from([
-            (i, {
-                'name': name,
-                'status': EMPTY # TODO: Change this class so that the status is an object separate from the graph
-            })
-            for i,name in enumerate(G)
-        ])
-        name2idx = dict([(name,i) for i,name in enumerate(G)])
-        newG.add_edges_from([
-            (name2idx[n1],name2idx[n2])
-            for n1,n2 in G.edges
-        ])
-        self.G = newG
+    '''
+        G is a networkx graph or a BoardGraph. For a BoardGraph the places are named 0,...,n-1 (unless names are given)
+        and no layout is computed.
+        Previous boards are remembered by their Zobrist hash. When verify_hashes is True, a repeated hash is only
+        considered a violation of the Ko rule when the boards are actually equal.
+        With prune, the siblings of a move are discarded from the game tree when the move is played. When max_nodes is
+        given and the tree has more nodes after a move is played, the subtrees that were visited least recently are
+        discarded until it fits (the line that has been played is always kept).
+    '''
+    def __init__(self,G,komi=3.5,pos=None,verify_hashes=False,prune=False,max_nodes=None,names=None):
+        # We want a board with indices 0,...,n-1, where the status of each place is stored in an int8 array
+        if isinstance(G,BoardGraph):
+            self.names = list(range(G.n)) if names is None else list(names)
+            self.graph = G
+            if pos is None:
+                pos = {}
+        else:
+            self.names = list(G)
+            self.graph = BoardGraph.FromNetworkx(G)
+        self.board = np.full(self.graph.n,EMPTY,dtype=np.int8)
+        self._G = None
+        self.groups = GroupIndex(self.graph.neighbors)
+        self.territory = TerritoryIndex(self.graph.neighbors,self.board.tolist())
         self.komi=komi
         self.turn = BLACK
-        self.states = {self.current_state()}
+        self.verify_hashes = verify_hashes
+        self.hash = self.graph.zobrist_hash(self.board.tolist())
+        self.hashes = {self.hash}
         self.captures = {BLACK: 0, WHITE: 0}
         self.moves = []
         self.ended = False
         self.final_score = {}
+        self.prune = prune
+        self.max_nodes = max_nodes
+        self.clock = 0 # The number of moves that have been played, used to tell when a node was visited for the last time
+        self.node_count = 1
+        self.peak_nodes = 1
         self.gamenode = GameNode(state=self.current_gamestate(),game=self)
         
         if pos is None:
             pos=nx.spring_layout(G)
         self.pos={
             idx: pos[name]
-            for name,idx in name2idx.items()
+            for idx,name in enumerate(self.names)
+            if name in pos
         }
+
+    '''
+        Creates a game on graph that continues from a snapshot of a game node (see GameNode.snapshot).
+        This is used to search positions in other processes, without sending the game tree.
+    '''
+    @classmethod
+    def FromSnapshot(cls,graph,komi,snapshot):
+        board,(black_captures,white_captures),passed,turn,zobrist,history = snapshot
+        game = cls(graph,komi=komi)
+        game.board[:] = board
+        for i,s in enumerate(board):
+            if s!=EMPTY:
+                game.groups.place(i,s)
+        game.territory = TerritoryIndex(graph.neighbors,board)
+        game.captures = {BLACK: black_captures, WHITE: white_captures}
+        game.turn = turn
+        game.hash = zobrist
+        game.hashes = set(history)
+        game.moves = ['pass'] if passed else []
+        state = GameState(board,black_captures,white_captures,passed=passed,zobrist=zobrist)
+        game.gamenode = GameNode(state=state,game=game,turn=turn)
+        return game
+
+    # The networkx graph with indices 0,...,n-1 is only built when it is asked for (e.g. for drawing)
+    @property
+    def G(self):
+        if self._G is None:
+            self._G = nx.Graph()
+            self._G.add_nodes_from([
+                (i, {'name': name})
+                for i,name in enumerate(self.names)
+            ])
+            self._G.add_edges_from(self.graph.edges.tolist())
+        return self._G
         
     def current_state(self):
-        return tuple(self.G.nodes[i]['status'] for i in self.G)
+        return tuple(self.board.tolist())
     def current_gamestate(self):
-        return GameState(tuple(self.G.nodes[i]['status'] for i in self.G),self.captures[BLACK],self.captures[WHITE])
+        return GameState(array('b',self.board.tobytes()),self.captures[BLACK],self.captures[WHITE],zobrist=self.hash)
     
     def next_turn(self):
         self.turn = self.turn.opponent()
@@ -161,68 +1103,125 @@ class GoGame:
             print(self.gamenode.state.boardstate())
             print(self.current_state())
         self.gamenode.appendNode(move)
-        if move in self.gamenode.childNodes:
-            self.gamenode = self.gamenode.childNodes[move]
         if move=='pass':
+            self.advance_gamenode(move)
             # Check if the last move was also a pass
-            if self.moves[-1]=='pass':
+            if self.moves and self.moves[-1]=='pass':
                 self.end_game()
             # Register move and do nothing
             self.moves.append(move)
             self.next_turn()
             return
-        if move not in self.G.nodes or self.G.nodes[move]['status']!=EMPTY:
+        if move not in range(self.graph.n) or self.board[move]!=EMPTY:
             # Move not allowed
             raise Exception("This move does not correspond to an empty node")
         
-        # We change the state, but might revert it if this move causes ko
-        self.G.nodes[move]['status'] = self.turn
-        
-        # Process captures
-        gg = group_graph(self.G)
-        captures = compute_captures(gg)
+        # The group index tells us which stones would be captured, without changing the board
+        captures, suicide = self.groups.compute_captures(move,self.turn)
         
         # Check suicide rule
-        if {self.G.nodes[i]['status'] for i in captures} == {self.turn}:
-            # Revert and raise exception
-            self.G.nodes[move]['status'] = EMPTY
+        if suicide:
             raise Exception("This move would lead to self-capture without capturing enemy stones, which is not allowed.")
-        # If it is a legit capture, then it will only capture stones of the opponent
-        captures = [i for i in captures if self.G.nodes[i]['status'] != self.turn]
-        
-        # Process captures
-        for i in captures:
-            self.G.nodes[i]['status'] = EMPTY
-        # Add score
-        self.captures[self.turn]+=len(captures)
         
         # Check Ko rule
-        if self.current_state() in self.states:
-            # Revert and raise exception
-            self.G.nodes[move]['status'] = EMPTY
-            opponent = self.turn.opponent()
+        zobrist = self.graph.zobrist_move(self.hash,move,self.turn,captures)
+        board = None
+        if self.verify_hashes:
+            board = self.board.tolist()
+            board[move] = self.turn
             for i in captures:
-                self.G.nodes[i]['status'] = opponent
+                board[i] = EMPTY
+            board = tuple(board)
+        if self.gamenode.repeats(zobrist,board):
             raise Exception("This move brings the board back to a previous state and therefore violates the Ko rule.")
+        
+        # The move is legal, so we change the state and process the captures
+        self.groups.place(move,self.turn)
+        self.territory.place(move,self.turn,captures)
+        self.board[move] = self.turn
+        self.board[captures] = EMPTY
+        # Add score
+        self.captures[self.turn]+=len(captures)
             
         # Add the new state and add the move
-        self.states.add(self.current_state())
+        self.hash = zobrist
+        self.hashes.add(zobrist)
+        self.advance_gamenode(move)
         self.moves.append(move)
         
         # Proceed to the next turn
         self.next_turn()
+
+    def advance_gamenode(self,move):
+        if move not in self.gamenode.childNodes:
+            return
+        self.peak_nodes = max(self.peak_nodes,self.node_count)
+        parent = self.gamenode
+        self.gamenode = parent.childNodes[move]
+        self.clock += 1
+        if self.prune:
+            for sibling,child in parent.childNodes.items():
+                if sibling!=move:
+                    self.node_count -= child.discard()
+            parent.childNodes = {move: self.gamenode}
+            parent.appended = False
+            parent.checked = None
+        if self.max_nodes is not None and self.node_count>self.max_nodes:
+            self.evict_nodes()
+
+    '''
+        Discards the subtrees that were visited least recently until the tree has at most max_nodes nodes, or only the
+        played line and the current game node are left. Nodes are visited when a child is added to them, so a node is
+        visited at least as recently as its descendants and we can discard complete subtrees at once.
+    '''
+    def evict_nodes(self):
+        protected = set()
+        node = self.gamenode
+        while node is not None:
+            protected.add(id(node))
+            root = node
+            node = node.parent
+        # Find the clock of the last visit before which we have to discard all nodes to fit in max_nodes
+        visits = {}
+        nodes = [root]
+        while nodes:
+            node = nodes.pop()
+            if id(node) not in protected:
+                visits[node.visited] = visits.get(node.visited,0)+1
+            nodes.extend(node.childNodes.values())
+        count = self.node_count
+        threshold = None
+        for visited in sorted(visits):
+            count -= visits[visited]
+            threshold = visited
+            if count<=self.max_nodes:
+                break
+        if threshold is None:
+            return
+        nodes = [root]
+        while nodes:
+            node = nodes.pop()
+            for move,child in list(node.childNodes.items()):
+                if id(child) not in protected and child.visited<=threshold:
+                    self.node_count -= child.discard()
+                    del node.childNodes[move]
+                    node.appended = False
+                else:
+                    nodes.append(child)
         
     def draw_state(self,pos=None):
+        import matplotlib.pyplot as plt
         if pos is None:
             pos = self.pos
+        statuses = [Status(s) for s in self.board.tolist()]
         nx.draw_networkx(self.G,
                          pos=pos,
                          node_color=[
-                             self.G.nodes[i]['status'].color()
+                             statuses[i].color()
                              for i in self.G.nodes
                          ],
                          with_labels=False,
-                         edgecolors=['white' if self.G.nodes[i]['status']==BLACK else 'black' for i in self.G.nodes])
+                         edgecolors=['white' if statuses[i]==BLACK else 'black' for i in self.G.nodes])
         nx.draw_networkx_labels(self.G,
                                pos=pos,
                                font_size=10,
@@ -230,7 +1229,7 @@ class GoGame:
                                labels = {
                                    i: str(i)
                                    for i in self.G.nodes
-                                   if self.G.nodes[i]['status']==EMPTY
+                                   if statuses[i]==EMPTY
                                })
         plt.axis('off')
         
@@ -241,70 +1240,82 @@ class GoGame:
         scores = self.final_score
         win = BLACK if scores[BLACK]>scores[WHITE] else WHITE
         print(f'{win} wins with {scores[win]-scores[win.opponent()]} points (Black: {scores[BLACK]}, White: {scores[WHITE]})')
+        print(f'The game tree had at most {max(self.peak_nodes,self.node_count)} nodes')
         print(self.gamenode.preceding_moves())
         
     
     '''
         Return the state that follows after applying the move. We do this without modifying the state or game. If the state is illegal, this will return a string describing the violation.
     '''
-    def apply_move(self,move,game_node):
+    '''
+        checked may be the result of check_move for the same move and node, so that it doesn't need to be computed again.
+    '''
+    def apply_move(self,move,game_node,checked=None):
         state = game_node.state
         color = game_node.turn
         if not isinstance(state,GameState):
             return "One cannot perform a move from an illegal game node."
-        if move=="pass" and state.passed:
-            # End the game
-            captures = state.captures()
-            return GameState(state.boardstate(),
-                             black_captures=captures[BLACK],
-                             white_captures=captures[WHITE],
-                             passed=True,
-                             ended=True)
-        elif move=="pass" and not state.passed:
-            captures = state.captures()
-            return GameState(state.boardstate(),
-                             black_captures=captures[BLACK],
-                             white_captures=captures[WHITE],
-                             passed=True,
-                             ended=False)
-
-        # Convert to list
-        state_list = list(state)
+        if move=="pass":
+            # The board doesn't change, so the new state shares it. Two passes in a row end the game.
+            return GameState(state.board,*state._captures,passed=True,ended=state.passed,zobrist=state.zobrist)
+
+        result = checked if checked is not None else self.check_move(move,game_node)
+        if isinstance(result,str):
+            return result
+        move,captures,zobrist = result
+
+        # Copy the board and process the move and captures
+        board = state.board[:]
+        board[move] = color
+        for i in captures:
+            board[i] = EMPTY
+        # Add score
+        black_captures,white_captures = state._captures
+        if color==BLACK:
+            black_captures += len(captures)
+        else:
+            white_captures += len(captures)
+        
+        return GameState(board,black_captures,white_captures,zobrist=zobrist)
+
+    '''
+        Checks whether placing a stone at move is legal at game_node, without building the next state. If it is illegal,
+        this returns a string describing the violation. Otherwise it returns the move, the captured stones and the hash
+        of the next board.
+    '''
+    def check_move(self,move,game_node):
+        state = game_node.state
+        color = game_node.turn
         move = int(move)
         if move>=len(state) or move<0 or state[move] != EMPTY:
             return f"Move {move} does not correspond to an empty place."
-        state_list[move] = color
-        captures = self.find_captures(state_list)
+        captures, suicide = self.graph.compute_captures(state.board,move,color)
 
         # Check suicide rule
-        if {state_list[i] for i in captures} == {color}:
+        if suicide:
             return "This move would lead to self-capture without capturing enemy stones, which is not allowed."
-        # If it is a legit capture, then it will only capture stones of the opponent
-        captures = [i for i in captures if state_list[i] != color]
-        
-        # Process captures
-        for i in captures:
-            state_list[i] = EMPTY
-        # Add score
-        newcaptures = state.captures()
-        newcaptures[color] +=len(captures)
-        newstate = GameState(state_list,newcaptures[BLACK],newcaptures[WHITE])
         
         # Check Ko rule
-        if newstate.boardstate() in game_node.previous_boardstates:
+        zobrist = self.graph.zobrist_move(state.zobrist,move,color,captures)
+        if self.verify_hashes:
+            board = list(state.board)
+            board[move] = color
+            for i in captures:
+                board[i] = EMPTY
+            board = tuple(board)
+        else:
+            board = None
+        if game_node.repeats(zobrist,board):
             return "This move brings the board back to a previous state and therefore violates the Ko rule."
-        
-        return newstate
+        return move,captures,zobrist
     
+    # The score of the current board, from the territory that is kept up to date after every move
     def compute_score(self):
-        scores = {
-            BLACK: self.captures[BLACK],
-            WHITE: self.komi+self.captures[WHITE]
+        territory = self.territory.territory
+        return {
+            BLACK: self.captures[BLACK]+territory[BLACK],
+            WHITE: self.komi+self.captures[WHITE]+territory[WHITE]
         }
-        gg = group_graph(self.G)
-        for color,territory in compute_territory(gg).items():
-            scores[color]+=territory
-        return scores
     
     def group_graph(self,state=None):
         if state is None:
@@ -345,51 +1356,78 @@ class GoGame:
             if (state[i] == EMPTY or state[j] == EMPTY) and (node_label[i]!=node_label[j])
         ])
         return gg
-    
-    def find_captures(self,state):
-        captures = []
-        gg = self.group_graph(state)
-        for i in gg:
-            if gg.nodes[i]['status']==EMPTY:
-                continue
-            neigh_statuses = set([
-                gg.nodes[n]['status']
-                for n in gg[i]
-            ])
-            if EMPTY in neigh_statuses:
-                continue # i has at least one freedom, it is not captured
-            # i does not neighbor an unoccupied group, it is captured
-            captures+=gg.nodes[i]['ids']
-        return captures
             
 class GameNode:
     '''
         State may be None. At least one of game or parent should be given.
-        When parent is None, we assume it is the initial state of the game.
+        When parent is None, we assume it is the initial state of the game, where it is the turn of black unless
+        turn says otherwise.
     '''
-    def __init__(self,state=None,parent=None,game=None):
+    __slots__ = ('state','is_start','parent','game','turn','move','childNodes','appended','checked','visited')
+
+    def __init__(self,state=None,parent=None,game=None,turn=None,move='pass'):
         self.state = state # state may be None if the preceding move is illegal
         self.is_start = (parent is None)
         self.parent = parent
+        self.move = move # The move that led from the parent to this node
         self.game = game if self.is_start else parent.game
-        self.turn = BLACK if self.is_start else parent.turn.opponent()
-        self.previous_boardstates = set() if self.is_start else parent.previous_boardstates|{parent.state.boardstate()}
+        if turn is None:
+            turn = BLACK if self.is_start else parent.turn.opponent()
+        self.turn = turn
         self.childNodes = dict() # A dictionary from move to child node
         self.appended = False
+        self.checked = None # The last move that generate_moves yielded and the result of check_move for it
+        self.visited = self.game.clock # The last time that a child was added to this node
 
     def appendNode(self,move,verbose=False):
+        self.visited = self.game.clock
         if self.state.ended or move in self.childNodes:
             return
         if not isinstance(self.state,GameState):
             print("Trying to append a node from a node with illegal state",self.state)
             return # Don't do anything if this is an illegal state
-        newstate = self.game.apply_move(move,game_node=self)
-        if isinstance(newstate,tuple):
-            self.childNodes[move] = GameNode(newstate,parent=self)
+        checked = None
+        if self.checked is not None and self.checked[0]==move:
+            checked = self.checked[1]
+            self.checked = None
+        newstate = self.game.apply_move(move,game_node=self,checked=checked)
+        if isinstance(newstate,GameState):
+            self.childNodes[move] = GameNode(newstate,parent=self,move=move)
+            self.game.node_count += 1
         elif verbose: 
             print(f"Move {move} is illegal")
 
+    # Returns the child that follows after move, creating it if needed. Returns None if the move is illegal.
+    def child(self,move):
+        self.appendNode(move)
+        return self.childNodes.get(move)
+
+    '''
+        Yields the legal moves in the order of key (or pass followed by the empty places when key is None), with the
+        move first at the front. Legality is checked just before a move is yielded, without creating the child nodes,
+        so a search that stops early doesn't check or create the other children. When places is given, only pass and
+        these empty places are candidates (see BoardGraph.distinct_places).
+    '''
+    def generate_moves(self,key=None,first=None,places=None):
+        if self.state.ended:
+            return
+        candidates = ['pass']+(self.state.places_with_status(EMPTY) if places is None else list(places))
+        if key is not None:
+            candidates.sort(key=key)
+        if first is not None and first in candidates:
+            candidates.remove(first)
+            candidates.insert(0,first)
+        for move in candidates:
+            if move=='pass' or move in self.childNodes:
+                yield move
+            elif not self.appended:
+                result = self.game.check_move(move,self)
+                if not isinstance(result,str):
+                    self.checked = (move,result)
+                    yield move
+
     def appendAll(self,verbose=False):
+        self.visited = self.game.clock
         if self.state.ended or self.appended:
             return
         if 'pass' not in self.childNodes:
@@ -399,61 +1437,258 @@ class GameNode:
                 self.appendNode(move,verbose=verbose)
         self.appended = True
 
+    '''
+        Whether the board with the given Zobrist hash occurred at this node or at one of its ancestors.
+        The boards along the line that the game has actually played are looked up in game.hashes, so we only walk
+        the part of the line that hasn't been played yet. When board is given, equal hashes are only counted when the
+        boards are equal as well.
+    '''
+    def repeats(self,zobrist,board=None):
+        game = self.game
+        node = self
+        while node is not game.gamenode:
+            if node is None:
+                # This node is not a descendant of the current game node, so we have checked the complete history
+                return False
+            if node.state.zobrist==zobrist and (board is None or node.state.boardstate()==board):
+                return True
+            node = node.parent
+        if zobrist not in game.hashes:
+            return False
+        if board is None:
+            return True
+        while node is not None:
+            if node.state.zobrist==zobrist and node.state.boardstate()==board:
+                return True
+            node = node.parent
+        return False
+
+    # The hashes of this board and all boards that preceded it
+    def history(self):
+        game = self.game
+        hashes = set()
+        node = self
+        while node is not None and node is not game.gamenode:
+            hashes.add(node.state.zobrist)
+            node = node.parent
+        if node is not None:
+            hashes |= game.hashes
+        return hashes
+
+    '''
+        Everything that is needed to continue the game from this node: the board, the captures, whether the last
+        move was a pass, the turn, the hash of the board and the hashes of the previous boards.
+    '''
+    def snapshot(self):
+        state = self.state
+        return (state.boardstate(),state._captures,state.passed,self.turn,state.zobrist,frozenset(self.history()))
+
+    # Detaches the subtree of this node from the tree and returns its number of nodes.
+    # The references between parents and children are removed, so that the nodes are freed without waiting for the garbage collector.
+    def discard(self):
+        size = 0
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            size += 1
+            nodes.extend(node.childNodes.values())
+            node.childNodes = {}
+            node.parent = None
+        return size
+
     def last_move(self):
         if self.parent is None:
             return "pass" # When it doesn't have a preceding move (i.e., beginning of the game), we return pass
-        for move,child in self.parent.childNodes.items():
-            if child==self:
-                return move
-
+        return self.move
 
     def preceding_moves(self):
-        if self.parent is None:
-            return []
-        return self.parent.preceding_moves()+[self.last_move()]
+        moves = []
+        node = self
+        while node.parent is not None:
+            moves.append(node.move)
+            node = node.parent
+        moves.reverse()
+        return moves
 
     @classmethod
     def FromGame(cls,game):
-        state = GameState(game.current_state(),game.captures[BLACK],game.captures[WHITE])
-        return GameNode(state=state,game=game)
+        return GameNode(state=game.current_gamestate(),game=game)
+
+
+class SearchBoard:
+    '''
+        A single mutable position for searches that follow one line at a time: play(move) changes the board in place
+        and undo() takes back the last move, using a stack of the captured stones and the previous hashes.
+        It can be used where a bot expects a GameNode or a GameState (it is its own state), so that the evaluation and
+        the keys of the transposition table work on both. Previous boards are compared by their hash only.
+    '''
+    def __init__(self,node):
+        state = node.state
+        self.game = node.game
+        self.graph = node.game.graph
+        self.board = state.board[:]
+        self._captures = state._captures
+        self.zobrist = state.zobrist
+        self.passed = state.passed
+        self.ended = state.ended
+        self.turn = node.turn
+        self.history = node.history()
+        self.first_move = node.last_move()
+        self.stack = [] # (move, captured stones, previous hash, previous captures, previous passed) for each move
+        self.checked = None # The last move that generate_moves yielded, with its captures and hash
+
+    @property
+    def state(self):
+        return self
+
+    def __getitem__(self,key):
+        if key==BLACK:
+            return self._captures[0]
+        return self._captures[1]
+
+    def array(self):
+        return np.frombuffer(self.board.tobytes(),dtype=np.int8)
+
+    def last_move(self):
+        return self.stack[-1][0] if self.stack else self.first_move
+
+    # Like GameNode.snapshot, for the current position
+    def snapshot(self):
+        return (tuple(self.board),self._captures,self.passed,self.turn,self.zobrist,frozenset(self.history))
+
+    # The captures and the new hash when the player to move places a stone at move, or None if this is illegal
+    def check(self,move):
+        if self.board[move]!=EMPTY:
+            return None
+        color = self.turn
+        captures, suicide = self.graph.compute_captures(self.board,move,color)
+        if suicide:
+            return None
+        zobrist = self.graph.zobrist_move(self.zobrist,move,color,captures)
+        if zobrist in self.history:
+            return None
+        return captures,zobrist
+
+    # Plays move for the player to move and returns True, or returns False without changing anything if it is illegal
+    def play(self,move):
+        checked = self.checked
+        self.checked = None
+        if self.ended:
+            return False
+        if move=='pass':
+            self.stack.append((move,None,self.zobrist,self._captures,self.passed))
+            self.ended = self.passed
+            self.passed = True
+            self.turn = self.turn.opponent()
+            return True
+        if checked is not None and checked[0]==move:
+            captures,zobrist = checked[1]
+        else:
+            result = self.check(move)
+            if result is None:
+                return False
+            captures,zobrist = result
+        color = self.turn
+        board = self.board
+        self.stack.append((move,captures,self.zobrist,self._captures,self.passed))
+        board[move] = color
+        for i in captures:
+            board[i] = EMPTY
+        if captures:
+            black,white = self._captures
+            self._captures = (black+len(captures),white) if color==BLACK else (black,white+len(captures))
+        self.zobrist = zobrist
+        self.history.add(zobrist)
+        self.passed = False
+        self.turn = color.opponent()
+        return True
+
+    def undo(self):
+        self.checked = None
+        move,captures,zobrist,previous_captures,passed = self.stack.pop()
+        self.turn = self.turn.opponent()
+        if move!='pass':
+            board = self.board
+            self.history.discard(self.zobrist)
+            board[move] = EMPTY
+            color = self.turn.opponent()
+            for i in captures:
+                board[i] = color
+        self.zobrist = zobrist
+        self._captures = previous_captures
+        self.passed = passed
+        self.ended = False
+
+    # Yields the legal moves like GameNode.generate_moves
+    def generate_moves(self,key=None,first=None,places=None):
+        if self.ended:
+            return
+        candidates = ['pass']+([i for i,s in enumerate(self.board) if s==EMPTY] if places is None else list(places))
+        if key is not None:
+            candidates.sort(key=key)
+        if first is not None and first in candidates:
+            candidates.remove(first)
+            candidates.insert(0,first)
+        for move in candidates:
+            if move=='pass':
+                yield move
+                continue
+            result = self.check(move)
+            if result is not None:
+                self.checked = (move,result)
+                yield move
 
 
 '''
-    Immutable object, state[BLACK],game[WHITE] give the captures of black and white respectively
+    Immutable object, state[BLACK],game[WHITE] give the captures of black and white respectively.
+    The board is an array of signed bytes. A state takes over a board that is given as an array, and the states after
+    a pass share the board of the state before it, so the board of a state should never be modified.
 '''
-class GameState(tuple):
-    def __new__ (cls, state, black_captures=0, white_captures=0, **kwargs):
-        return super(GameState, cls).__new__(cls, tuple(state))
-    
-    def __init__ (self, state, black_captures=0, white_captures=0,passed=False,ended=False):
+class GameState:
+    __slots__ = ('board','_captures','zobrist','passed','ended')
+
+    def __init__ (self, state, black_captures=0, white_captures=0,passed=False,ended=False,zobrist=0):
+        self.board = state if type(state) is array else array('b',state)
         self._captures = (black_captures,white_captures)
+        self.zobrist = zobrist
         self.passed = passed
         self.ended = ended
 
     def __getitem__(self,key):
-        if key==BLACK:
-            return self._captures[0]
-        if key==WHITE:
-            return self._captures[1]
-        return tuple.__getitem__(self,key)
+        # Statuses are ints as well, so we need to check the type to distinguish captures from places
+        if isinstance(key,Status):
+            if key==BLACK:
+                return self._captures[0]
+            if key==WHITE:
+                return self._captures[1]
+        return self.board[key]
+
+    def __len__(self):
+        return len(self.board)
+
+    def __iter__(self):
+        return iter(self.board)
     
     def captures(self):
         return dict(zip([BLACK,WHITE],self._captures))
     
     def boardstate(self):
-        return tuple(self)
+        return tuple(self.board)
     
     def places_with_status(self,status):
-        return [i for i,s in enumerate(self) if s==status]
+        return [i for i,s in enumerate(self.board) if s==status]
     
     def empties(self):
-        return [i for i,s in enumerate(self) if s==EMPTY]
+        return self.places_with_status(EMPTY)
     
     def blacks(self):
-        return [i for i,s in enumerate(self) if s==BLACK]
+        return self.places_with_status(BLACK)
     
     def whites(self):
-        return [i for i,s in enumerate(self) if s==WHITE]
+        return self.places_with_status(WHITE)
+
+    def array(self):
+        return np.frombuffer(self.board.tobytes(),dtype=np.int8)
 
         
             
\ No newline at end of file
@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import sys
+from time import perf_counter
+import numpy as np
+
+'''
+    Load test of server.py: many clients play random games at the same time, each on its own connection, and we
+    report the moves per second and the latency of the requests. Run `python loadtest.py --help` for the options.
+    Unless --port is given, a server is started in a separate process. With --deltas, the clients ask for the changes
+    of the board since their last update instead of the whole board.
+'''
+
+class Client:
+    def __init__(self,reader,writer):
+        self.reader = reader
+        self.writer = writer
+        self.received = 0 # Bytes of the bodies of the responses
+
+    @classmethod
+    async def Connect(cls,host,port):
+        return cls(*await asyncio.open_connection(host,port))
+
+    # Sends a request and returns the status and the decoded response
+    async def request(self,method,path,body=None):
+        data = b'' if body is None else json.dumps(body).encode()
+        self.writer.write(f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(data)}\r\n\r\n'.encode()+data)
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n',b''):
+                break
+            name,_,value = line.decode('latin-1').partition(':')
+            if name.strip().lower()=='content-length':
+                length = int(value)
+        self.received += length
+        return status,json.loads(await self.reader.readexactly(length))
+
+    def close(self):
+        self.writer.close()
+
+# Applies an update from the server to state (a list of statuses): the whole board, or the changes of the board
+def apply_update(state,info):
+    if 'state' in info:
+        state[:] = info['state']
+    else:
+        changes = info['changes']
+        for k in range(0,len(changes),2):
+            state[changes[k]] = changes[k+1]
+
+'''
+    Plays games with random moves until the deadline, and appends the latency of every move request to latencies.
+    Returns the number of games, the number of moves that were played (the others were illegal) and the bytes that
+    were received.
+'''
+async def play(host,port,board,opponent,deadline,latencies,rng,max_moves,deltas=False):
+    client = await Client.Connect(host,port)
+    games = 0
+    played = 0
+    try:
+        while perf_counter()<deadline:
+            _,info = await client.request('POST','/games',{'board': board, 'black': 'you', 'white': opponent})
+            key = info['key']
+            state = []
+            apply_update(state,info)
+            moves = 0
+            while not info['ended'] and moves<max_moves and perf_counter()<deadline:
+                empty = [i for i,s in enumerate(state) if s==-1]
+                move = rng.choice(empty) if empty and rng.random()>0.05 else 'pass'
+                body = {'move': move, 'since': info['version']} if deltas else {'move': move}
+                start = perf_counter()
+                status,response = await client.request('POST',f'/games/{key}/moves',body)
+                latencies.append(perf_counter()-start)
+                moves += 1
+                if status==200:
+                    info = response
+                    apply_update(state,info)
+                    played += 1
+            await client.request('DELETE',f'/games/{key}')
+            games += 1
+    finally:
+        client.close()
+    return games,played,client.received
+
+async def run(host,port,clients,seconds,board,opponent,seed,max_moves,deltas=False):
+    latencies = []
+    deadline = perf_counter()+seconds
+    start = perf_counter()
+    results = await asyncio.gather(*[
+        play(host,port,board,opponent,deadline,latencies,random.Random(seed+i),max_moves,deltas)
+        for i in range(clients)
+    ])
+    elapsed = perf_counter()-start
+    client = await Client.Connect(host,port)
+    _,stats = await client.request('GET','/stats')
+    client.close()
+    latencies = np.array(latencies)
+    games = sum(result[0] for result in results)
+    played = sum(result[1] for result in results)
+    received = sum(result[2] for result in results)
+    print(f'{clients} clients on {board} against {opponent}: {games} games, {played} moves ({len(latencies)-played} illegal) '
+          f'in {elapsed:.1f}s, {played/elapsed:.0f} moves/s, {len(latencies)/elapsed:.0f} requests/s, latency p50 {1000*np.percentile(latencies,50):.1f}ms, '
+          f'p99 {1000*np.percentile(latencies,99):.1f}ms, max {1000*latencies.max():.1f}ms, {received/len(latencies):.0f}B/request')
+    print(f'server: {stats}')
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1',0))
+        return s.getsockname()[1]
+
+async def wait_for_server(host,port,timeout=30):
+    start = perf_counter()
+    while True:
+        try:
+            _,writer = await asyncio.open_connection(host,port)
+            writer.close()
+            return
+        except OSError:
+            if perf_counter()-start>timeout:
+                raise
+            await asyncio.sleep(0.1)
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Load test of the game server.')
+    parser.add_argument('--host',default='127.0.0.1')
+    parser.add_argument('--port',type=int,default=None,help='port of a running server (default: start one)')
+    parser.add_argument('--clients',type=int,default=200,help='games that are played at the same time')
+    parser.add_argument('--seconds',type=float,default=10)
+    parser.add_argument('--board',default='GRID 9 9')
+    parser.add_argument('--opponent',default='you',help='the player with white, e.g. "AlphaBeta 1" (default: the client itself)')
+    parser.add_argument('--max-moves',type=int,default=200,help='moves after which a client starts a new game')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--deltas',action='store_true',help='ask for the changes of the board only')
+    args = parser.parse_args()
+
+    server = None
+    port = args.port
+    if port is None:
+        port = free_port()
+        server = subprocess.Popen([sys.executable,'server.py','--host',args.host,'--port',str(port)],stdout=subprocess.DEVNULL)
+    try:
+        asyncio.run(wait_for_server(args.host,port))
+        asyncio.run(run(args.host,port,args.clients,args.seconds,args.board,args.opponent,args.seed,args.max_moves,args.deltas))
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
@@ -1,5 +1,9 @@
 import networkx as nx
 import itertools as it
+import json
+import os
+import random
+import shutil
 import numpy as np
 
 def generate_grid(width,length):
@@ -19,6 +23,43 @@ def generate_grid(width,length):
     }
     return grid,grid_pos
 
+# Graphs with more nodes than this get a spectral layout, since spring_layout is too slow for them
+SPRING_LAYOUT_MAX = 500
+
+'''
+    Positions for the nodes of G. Small graphs get a spring layout, larger ones a spectral layout, which takes a few
+    sparse eigenvectors instead of iterating over all pairs of nodes.
+'''
+def layout(G,seed=0):
+    if len(G)<=SPRING_LAYOUT_MAX:
+        return nx.spring_layout(G,seed=seed)
+    return nx.spectral_layout(G)
+
+'''
+    Makes G connected by adding an edge between every component and the largest one. When pos is given, we connect
+    the two closest nodes, so that geometric graphs stay geometric. Returns G.
+'''
+def connect_components(G,pos=None,seed=None):
+    components = sorted(nx.connected_components(G),key=len,reverse=True)
+    if len(components)<=1:
+        return G
+    rng = random.Random(seed)
+    if pos is None:
+        giant = list(components[0])
+        for component in components[1:]:
+            G.add_edge(rng.choice(sorted(component,key=str)),rng.choice(giant))
+        return G
+    from scipy.spatial import cKDTree
+    connected = list(components[0])
+    for component in components[1:]:
+        component = list(component)
+        tree = cKDTree([pos[v] for v in connected])
+        distances,nearest = tree.query([pos[v] for v in component])
+        i = int(np.argmin(distances))
+        G.add_edge(component[i],connected[nearest[i]])
+        connected += component
+    return G
+
 def karate_network():
     G = nx.karate_club_graph()
     return G, nx.spring_layout(G,seed=0)
@@ -27,27 +68,31 @@ def dodecahedral_graph():
     G = nx.dodecahedral_graph()
     return G, nx.spring_layout(G,seed=0)
 
-def random_regular(n=20,d=4):
-    G = nx.random_regular_graph(d, n)
-    return G, nx.spring_layout(G,seed=0)
+def random_regular(n=20,d=4,seed=None):
+    G = nx.random_regular_graph(d, n, seed=seed)
+    connect_components(G,seed=seed)
+    return G, layout(G)
 
-def random_communities():
-    G = nx.planted_partition_graph(3, 10,  1/3, 1/60)
-    if not nx.is_connected(G):
-        print('not connected')
-        return random_communities()
-    return G, nx.spring_layout(G,seed=0) # TODO: Normalize pos
+'''
+    n nodes (rounded down to a multiple of communities) in communities of equal size, where a node has on average
+    degree_in neighbors in its own community and degree_out in the other communities. The defaults give 3 communities
+    of 10 nodes.
+'''
+def random_communities(n=30,communities=3,degree_in=3,degree_out=1/3,seed=None):
+    size = n//communities
+    G = nx.planted_partition_graph(communities, size, min(degree_in/(size-1),1), min(degree_out/(n-size),1), seed=seed)
+    connect_components(G,seed=seed)
+    return G, layout(G) # TODO: Normalize pos
 
-def random_geometric(n=20,d=4):
+def random_geometric(n=20,d=4,seed=None):
     r = (d/(np.pi*n-np.pi))**0.5
-    G = nx.random_geometric_graph(n=20, radius=r)
-    print('RGG with mean deg',sum(dict(G.degree).values())/n,'is' if nx.is_connected(G) else 'is not','connected')
-    if not nx.is_connected(G):
-        return random_geometric(n=n,d=d)
-    return G, {
+    G = nx.random_geometric_graph(n=n, radius=r, seed=seed)
+    pos = {
         i: G.nodes[i]['pos']
         for i in G.nodes
     }
+    connect_components(G,pos=pos)
+    return G, pos
 
 
 def usa_network():
@@ -210,10 +255,9 @@ WY  41.145548  -104.802042'''
         for v,(x,y) in pos.items()
     }
 
-def random_voronoi(n=20,cells=True):
+def random_voronoi(n=20,cells=True,seed=None):
     from scipy.spatial import Voronoi
-    import numpy as np
-    coords = np.random.rand(n, 2)
+    coords = np.random.default_rng(seed).random((n, 2))
     vor = Voronoi(coords)
     G = nx.Graph()
     if cells:
@@ -225,7 +269,109 @@ def random_voronoi(n=20,cells=True):
         pos = dict(zip(range(n),coords))
     else:
         pos = dict(enumerate(vor.vertices))
-        print(vor.vertices)
-        print([(i,j) for i,j in vor.ridge_vertices if i>=0 and j>=0])
         G.add_edges_from([(i,j) for i,j in vor.ridge_vertices if i>=0 and j>=0])
-    return G,pos
\ No newline at end of file
+    connect_components(G,pos=pos)
+    return G,pos
+
+'''
+    Generates the board of a game from its name, like "USA", "GRID 9 9" or "REGULAR 20 3" (see the options in web/index.html).
+    The random boards can be given a size as well, like "COMMUNITIES 3000" or "VORONOI CELLS 1000".
+    When seed is given, the random generators are seeded with it.
+'''
+def generate_board(game_name,seed=None):
+    words = game_name.split(' ')
+    if words[0] == 'USA':
+        return usa_network()
+    if words[0] == 'KARATE':
+        return karate_network()
+    if words[0] == 'DODECAHEDRAL':
+        return dodecahedral_graph()
+    if words[0] == 'COMMUNITIES':
+        return random_communities(*[int(w) for w in words[1:2]],seed=seed)
+    if words[0] == 'GRID':
+        return generate_grid(int(words[1]),int(words[2]))
+    if words[0] == 'VORONOI':
+        return random_voronoi(*[int(w) for w in words[2:3]],cells=(words[1]=='CELLS'),seed=seed)
+    if words[0] == 'REGULAR':
+        return random_regular(int(words[1]),int(words[2]),seed=seed)
+    if words[0] == 'GEOMETRIC':
+        return random_geometric(int(words[1]),int(words[2]),seed=seed)
+    raise Exception(f"Unknown board {game_name}")
+
+# The names of the boards that can be chosen in the app
+BOARD_NAMES = ['GRID 5 3','GRID 4 4','GRID 5 5','GRID 7 7','GRID 9 9','USA','KARATE','COMMUNITIES','VORONOI CELLS',
+               'VORONOI RIDGES','REGULAR 20 3','GEOMETRIC 20 4','DODECAHEDRAL']
+
+# The boards that are the same every time they are generated, so that they can be cached without a seed
+DETERMINISTIC_BOARDS = ['GRID','USA','KARATE','DODECAHEDRAL']
+
+def _to_tuples(name):
+    return tuple(_to_tuples(x) for x in name) if isinstance(name,list) else name
+
+class BoardCache:
+    '''
+        Cache of generated boards on disk, keyed by the name of the board and the seed. Each board is a directory with
+        the edges (as indices of the places) and the positions as .npy files, which are memory-mapped when they are
+        loaded, and the names of the places as JSON. Random boards are only cached when a seed is given, and the seed is
+        ignored for the other boards.
+        hits and misses count the boards that were loaded from the cache and that had to be generated.
+    '''
+    VERSION = 1
+
+    def __init__(self,directory=None):
+        if directory is None:
+            directory = os.environ.get('GO_GRAPHS_CACHE',os.path.join(os.path.expanduser('~'),'.cache','go-graphs','boards'))
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def path(self,game_name,seed=None):
+        key = '_'.join(game_name.split(' '))+('' if seed is None else f'-seed{seed}')
+        return os.path.join(self.directory,f'v{self.VERSION}',key)
+
+    def cacheable(self,game_name,seed=None):
+        return seed is not None or game_name.split(' ')[0] in DETERMINISTIC_BOARDS
+
+    '''
+        Returns the BoardGraph of the board, the names of its places and a dictionary from names to positions, which
+        can be passed to GoGame as GoGame(graph,pos=pos,names=names).
+    '''
+    def load(self,game_name,seed=None):
+        from gographs import BoardGraph
+        if game_name.split(' ')[0] in DETERMINISTIC_BOARDS:
+            seed = None
+        path = self.path(game_name,seed)
+        if self.cacheable(game_name,seed) and os.path.isdir(path):
+            self.hits += 1
+            edges = np.load(os.path.join(path,'edges.npy'),mmap_mode='r')
+            positions = np.load(os.path.join(path,'pos.npy'),mmap_mode='r')
+            with open(os.path.join(path,'names.json')) as file:
+                names = [_to_tuples(name) for name in json.load(file)]
+            return BoardGraph.Cached(len(names),edges),names,dict(zip(names,positions))
+        self.misses += 1
+        G,pos = generate_board(game_name,seed)
+        names = list(G)
+        name2idx = {name: i for i,name in enumerate(names)}
+        edges = np.array([(name2idx[n1],name2idx[n2]) for n1,n2 in G.edges],dtype=np.int32).reshape(-1,2)
+        positions = np.array([pos[name] for name in names],dtype=np.float64).reshape(-1,2)
+        if self.cacheable(game_name,seed):
+            self.store(path,names,edges,positions)
+        return BoardGraph.Cached(len(names),edges),names,dict(zip(names,positions))
+
+    # Writes the board to a temporary directory first, so that processes that load the same board never see half of it
+    def store(self,path,names,edges,positions):
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        temporary = f'{path}.tmp{os.getpid()}'
+        os.makedirs(temporary,exist_ok=True)
+        np.save(os.path.join(temporary,'edges.npy'),edges)
+        np.save(os.path.join(temporary,'pos.npy'),positions)
+        with open(os.path.join(temporary,'names.json'),'w') as file:
+            json.dump(names,file,default=lambda x: x.item())
+        try:
+            os.rename(temporary,path)
+        except OSError:
+            # Another process stored the board first
+            shutil.rmtree(temporary,ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(os.path.join(self.directory,f'v{self.VERSION}'),ignore_errors=True)
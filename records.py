@@ -0,0 +1,205 @@
+import argparse
+import gzip
+import json
+from time import perf_counter
+from gographs import GoGame,BoardGraph,PlayoutBoard,TerritoryIndex,BLACK,WHITE,EMPTY
+
+'''
+    Game records: the board, the komi and the moves of a game, so that games can be archived and replayed.
+    A file of records has one JSON object per line (gzip compressed when the name ends in .gz):
+        {"board": "<fingerprint>", "n": 81, "edges": [0, 1, 0, 9, ...], "komi": 3.5, "moves": [40, -1, ...],
+         "score": [12, 15.5], "info": {"black": "AlphaBeta 2", ...}}
+    The edges of a board are only written with the first record on that board in a file, later records refer to it
+    by the fingerprint of the board (see BoardGraph.Fingerprint). Passes are written as -1. The score is only
+    written for games that have ended, and info holds whatever the writer wants to remember about the game.
+    Run `python records.py --help` to validate the records in a file.
+'''
+
+PASS = -1
+
+class GameRecord:
+    __slots__ = ('graph','komi','moves','score','info')
+
+    def __init__(self,graph,komi,moves,score=None,info=None):
+        self.graph = graph
+        self.komi = komi
+        self.moves = moves
+        self.score = score # {BLACK: ..., WHITE: ...} when the game has ended
+        self.info = {} if info is None else info
+
+    @classmethod
+    def FromGame(cls,game,info=None):
+        return cls(game.graph,game.komi,list(game.moves),dict(game.final_score) if game.ended else None,info)
+
+    def encode(self,with_edges=True):
+        record = {'board': self.graph.fingerprint}
+        if with_edges:
+            record['n'] = self.graph.n
+            record['edges'] = self.graph.edges.ravel().tolist()
+        record['komi'] = self.komi
+        record['moves'] = [PASS if move=='pass' else int(move) for move in self.moves]
+        if self.score is not None:
+            record['score'] = [self.score[BLACK],self.score[WHITE]]
+        if self.info:
+            record['info'] = self.info
+        return record
+
+    # graphs maps the fingerprints of the boards that were defined earlier in the file to their BoardGraph
+    @classmethod
+    def Decode(cls,record,graphs):
+        fingerprint = record['board']
+        if 'edges' in record:
+            graph = BoardGraph.Cached(record['n'],record['edges'])
+            if graph.fingerprint!=fingerprint:
+                raise Exception(f"The edges of board {fingerprint} don't match its fingerprint")
+            graphs[fingerprint] = graph
+        elif fingerprint in graphs:
+            graph = graphs[fingerprint]
+        else:
+            raise Exception(f"Board {fingerprint} is used before its edges are given")
+        score = record.get('score')
+        return cls(
+            graph,
+            record['komi'],
+            ['pass' if move==PASS else move for move in record['moves']],
+            None if score is None else {BLACK: score[0], WHITE: score[1]},
+            record.get('info'),
+        )
+
+    '''
+        Plays the moves on a PlayoutBoard, with the same rules as GoGame.process_move, and returns the final board.
+        Raises an exception if a move is illegal, if a move follows after the game has ended, or if the recorded score
+        is not the score of the final board. No game nodes are created, previous boards are remembered by their hash.
+    '''
+    def replay(self):
+        graph = self.graph
+        n = graph.n
+        zobrist = graph.zobrist
+        board = PlayoutBoard(graph.neighbors,[EMPTY]*n,(0,0),BLACK,self.komi)
+        places = board.board
+        h = 0
+        hashes = {h}
+        for i,move in enumerate(self.moves):
+            if board.passes>=2:
+                raise Exception(f"Move {i} is played after the game has ended")
+            if move=='pass':
+                board.play(move)
+                continue
+            if not 0<=move<n or places[move]!=EMPTY:
+                raise Exception(f"Move {i} ({move}) does not correspond to an empty node")
+            if move!=board.ko and not board.is_legal(move):
+                raise Exception(f"Move {i} ({move}) would lead to self-capture without capturing enemy stones")
+            color = board.turn
+            captured = board.play(move)
+            h ^= zobrist[color][move]
+            keys = zobrist[1-color]
+            for j in captured:
+                h ^= keys[j]
+            if h in hashes:
+                raise Exception(f"Move {i} ({move}) brings the board back to a previous state")
+            hashes.add(h)
+        if self.score is not None:
+            if board.passes<2:
+                raise Exception("The record has a score, but the game has not ended")
+            score = self.final_score(board)
+            if score!=self.score:
+                raise Exception(
+                    f"The recorded score (Black: {self.score[BLACK]}, White: {self.score[WHITE]}) is not the score "
+                    f"of the final board (Black: {score[BLACK]}, White: {score[WHITE]})"
+                )
+        return board
+
+    # The score of a board that was returned by replay, as in GoGame.compute_score
+    def final_score(self,board):
+        territory = TerritoryIndex(self.graph.neighbors,board.board).territory
+        return {BLACK: board.captures[BLACK]+territory[BLACK], WHITE: self.komi+board.captures[WHITE]+territory[WHITE]}
+
+    # Plays the record in a GoGame, e.g. to continue or analyse it. This is much slower than replay.
+    def to_game(self,**kwargs):
+        game = GoGame(self.graph,komi=self.komi,**kwargs)
+        for move in self.moves:
+            game.process_move(move)
+        return game
+
+def open_records(path,mode='r'):
+    if path.endswith('.gz'):
+        return gzip.open(path,mode+'t')
+    return open(path,mode)
+
+class RecordWriter:
+    '''
+        Writes records to a file object, one per line. The edges of each board are only written once.
+        As a context manager, it closes the file when it is done.
+    '''
+    def __init__(self,file):
+        self.file = file
+        self.boards = set()
+        self.count = 0
+
+    @classmethod
+    def Open(cls,path,mode='a'):
+        return cls(open_records(path,mode))
+
+    def write(self,record):
+        fingerprint = record.graph.fingerprint
+        self.file.write(json.dumps(record.encode(with_edges=fingerprint not in self.boards),separators=(',',':'))+'\n')
+        self.boards.add(fingerprint)
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+# Yields the records in the file at path one at a time, so that large files don't have to fit in memory
+def read_records(path):
+    graphs = {}
+    with open_records(path) as file:
+        for line in file:
+            if line.strip():
+                yield GameRecord.Decode(json.loads(line),graphs)
+
+def write_records(path,records,mode='w'):
+    with RecordWriter.Open(path,mode) as writer:
+        for record in records:
+            writer.write(record)
+        return writer.count
+
+'''
+    Replays all records in the file at path. Returns the number of records, the number of moves and the errors of the
+    invalid records as (index, message) pairs.
+'''
+def validate(path):
+    count = 0
+    moves = 0
+    errors = []
+    for i,record in enumerate(read_records(path)):
+        try:
+            record.replay()
+        except Exception as e:
+            errors.append((i,str(e)))
+        count += 1
+        moves += len(record.moves)
+    return count,moves,errors
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Validates files of game records by replaying them.')
+    parser.add_argument('paths',nargs='+')
+    parser.add_argument('--errors',type=int,default=10,help='invalid records to show per file')
+    args = parser.parse_args()
+
+    for path in args.paths:
+        start = perf_counter()
+        count,moves,errors = validate(path)
+        elapsed = perf_counter()-start
+        print(f'{path}: {count} records, {moves} moves, {len(errors)} invalid, in {elapsed:.2f}s '
+              f'({count/elapsed:.0f} records/s, {moves/elapsed:.0f} moves/s)')
+        for i,message in errors[:args.errors]:
+            print(f'  record {i}: {message}')
@@ -0,0 +1,448 @@
+import argparse
+import asyncio
+import base64
+import json
+import random
+import signal
+import string
+from collections import OrderedDict,deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import SyncManager
+from time import monotonic
+from urllib.parse import parse_qs
+import numpy as np
+import networks as nets
+import bots
+from records import GameRecord,RecordWriter
+from book import OpeningBook
+from gographs import GoGame,BLACK,WHITE
+
+'''
+    Headless server that plays many games at once, without the GUI. Run `python server.py --help` for the options.
+    It speaks JSON over HTTP/1.1 (with keep-alive):
+        POST   /games              {"board": "GRID 9 9", "black": "you", "white": "AlphaBeta 2", "komi": 3.5}
+        GET    /games/<key>        the state of the game, as sent to the GUI (?since=<version> for the changes only)
+        GET    /games/<key>/graph  the positions of the places and the edges (?binary=1 for packed arrays)
+        POST   /games/<key>/moves  {"move": 12} plays the move and answers after the bots have replied
+                                   (with "since": <version>, the answer only has the changes)
+        DELETE /games/<key>
+        GET    /stats              the number of games and the moves per second
+    Games in which only bots play are played in the background.
+'''
+
+# The number of updates of the board that a session remembers, so that clients that are behind get the changes only
+UPDATE_LOG = 32
+
+def generate_random_key(N=20):
+    return ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(N))
+
+# Base64 of the little-endian bytes of an array, which the GUI turns into a typed array
+def pack(array,dtype):
+    return base64.b64encode(np.ascontiguousarray(array,dtype=dtype).tobytes()).decode('ascii')
+
+class GameSession:
+    '''
+        A game with its bots. The version of the board is the number of moves that have been played. The session keeps
+        a copy of the board as it was sent last and a log of the places that changed between versions, so that a
+        client that has seen an earlier version only gets the places that changed since then.
+    '''
+    __slots__ = ('key','game','bots','last_used','search','cancel','description','version','board','updates')
+
+    def __init__(self,key,game,bots,description=None,cancel=None):
+        self.key = key
+        self.game = game
+        self.bots = bots # The bots by color, the other colors are played by people
+        self.description = description # The board and the players, as given when the game was created
+        self.version = len(game.moves)
+        self.board = game.board.copy()
+        self.updates = deque(maxlen=UPDATE_LOG) # (previous version, version, places that changed)
+        self.last_used = monotonic()
+        self.search = None # The future of the search of the bot that is to move, while it runs
+        self.cancel = cancel # The event that stops the searches of the bots in the workers when the game is removed
+
+    def bot_to_move(self):
+        return not self.game.ended and self.game.turn in self.bots
+
+    '''
+        The function and the arguments that search the move of the bot that is to move in a worker process.
+        The bot gets the position before the last move as well, so that it knows which move was played last.
+    '''
+    def bot_search(self):
+        game = self.game
+        node = game.gamenode
+        if node.parent is None:
+            snapshot,last_move = node.snapshot(),None
+        else:
+            snapshot,last_move = node.parent.snapshot(),node.last_move()
+        return (bots.choose_move_in_worker,(self.key,game.turn),self.bots[game.turn],game.graph,game.komi,snapshot,last_move,
+                self.cancel)
+
+    # Logs the places that changed since the last update
+    def sync(self):
+        version = len(self.game.moves)
+        if version==self.version:
+            return
+        board = self.game.board
+        changed = np.flatnonzero(board!=self.board)
+        self.board[changed] = board[changed]
+        self.updates.append((self.version,version,changed))
+        self.version = version
+
+    # The places that changed since the given version, or None if the log doesn't go back that far
+    def changes_since(self,since):
+        if since==self.version:
+            return np.empty(0,dtype=np.intp)
+        if not self.updates or not self.updates[0][0]<=since<self.version:
+            return None
+        if self.updates[-1][0]==since:
+            return self.updates[-1][2]
+        changed = [places for previous,_,places in self.updates if previous>=since]
+        return np.unique(np.concatenate(changed))
+
+    '''
+        The state of the game for the GUI. When since is the version that the client has, the board is sent as a flat
+        list of the places that changed and their new statuses ('changes'), otherwise the whole board is sent ('state').
+    '''
+    def info(self,since=None):
+        game = self.game
+        self.sync()
+        changed = None if since is None else self.changes_since(since)
+        if changed is None:
+            board = {'state': self.board.tolist()}
+        else:
+            changes = np.empty(2*len(changed),dtype=np.int64)
+            changes[0::2] = changed
+            changes[1::2] = self.board[changed]
+            board = {'since': since, 'changes': changes.tolist()}
+        return {
+            'key': self.key,
+            'version': self.version,
+            **board,
+            'komi': game.komi,
+            'turn': int(game.turn),
+            'captures': {
+                int(BLACK): game.captures[BLACK],
+                int(WHITE): game.captures[WHITE],
+            },
+            'ended': game.ended,
+            'thinking': self.search is not None,
+            'territory': {
+                int(BLACK): game.territory.territory[BLACK],
+                int(WHITE): game.territory.territory[WHITE],
+            },
+            'score': {
+                int(BLACK): game.final_score[BLACK],
+                int(WHITE): game.final_score[WHITE],
+            } if game.ended else {},
+        }
+
+    '''
+        The positions of the places and the edges. With binary, they are sent as packed arrays (float32 coordinates
+        x0,y0,x1,y1,... and the endpoints of the edges as uint16, or int32 on boards with more places), which are much
+        smaller than nested lists for large boards.
+    '''
+    def graph(self,binary=False):
+        game = self.game
+        if binary:
+            edge_type = '<u2' if game.graph.n<=np.iinfo(np.uint16).max else '<i4'
+            return {
+                'binary': True,
+                'n': game.graph.n,
+                'pos': pack(list(game.pos.values()),'<f4'),
+                'edges': pack(game.graph.edges,edge_type),
+                'edge_type': 'uint16' if edge_type=='<u2' else 'int32',
+            }
+        return {
+            'pos': [[float(x),float(y)] for x,y in game.pos.values()],
+            'edges': game.graph.edges.tolist(),
+        }
+
+class GameStore:
+    '''
+        The games that are being played, by key, with the most recently used last.
+        Games that haven't been used for ttl seconds (ended_ttl seconds once they have ended) are evicted, and when
+        there are more than max_games games, the least recently used ones are evicted. The memory of a game is capped
+        by pruning its tree of game nodes to at most max_nodes nodes, and the transposition tables of its bots to
+        table_mb megabytes. The search of an evicted game is cancelled, through an event of a manager process that the
+        searches in the workers check (see Bot.check_cancelled).
+        When archive (a RecordWriter) is given, the record of every game in which a move was played is written to it
+        when the game is removed. The bots look up the opening in book (an OpeningBook), if it is given.
+    '''
+    def __init__(self,max_games=1000,ttl=3600,ended_ttl=300,max_nodes=100000,table_mb=64,board_cache=None,archive=None,
+                 book=None):
+        self.sessions = OrderedDict()
+        self.max_games = max_games
+        self.ttl = ttl
+        self.ended_ttl = ended_ttl
+        self.max_nodes = max_nodes
+        self.table_mb = table_mb
+        self.board_cache = nets.BoardCache() if board_cache is None else board_cache
+        self.evicted = 0
+        self.archive = archive
+        self.book = book
+        self.manager = None
+
+    def __contains__(self,key):
+        return key in self.sessions
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def create(self,board,black="you",white="you",komi=3.5):
+        graph,names,pos = self.board_cache.load(board)
+        game = GoGame(graph,komi=komi,pos=pos,names=names,prune=True,max_nodes=self.max_nodes)
+        players = {BLACK: black, WHITE: white}
+        session_bots = {
+            color: bots.make_bot(player,game,table_mb=self.table_mb,book=self.book)
+            for color,player in players.items() if player!="you"
+        }
+        # The bots search in worker processes, which make their own transposition tables
+        for bot in session_bots.values():
+            if hasattr(bot,'table'):
+                bot.table = None
+        key = generate_random_key()
+        self.evict()
+        cancel = self.cancel_event() if session_bots else None
+        self.sessions[key] = GameSession(key,game,session_bots,{'board': board, 'black': black, 'white': white},cancel)
+        while len(self.sessions)>self.max_games:
+            self.remove(next(iter(self.sessions)))
+            self.evicted += 1
+        return self.sessions[key]
+
+    def get(self,key):
+        if key not in self.sessions:
+            raise Exception(f"Game {key} does not exist")
+        self.sessions.move_to_end(key)
+        session = self.sessions[key]
+        session.last_used = monotonic()
+        return session
+
+    def remove(self,key):
+        session = self.sessions.pop(key,None)
+        if session is None:
+            return
+        if session.search is not None:
+            session.search.cancel()
+            session.cancel.set()
+        if self.archive is not None and session.game.moves:
+            self.archive.write(GameRecord.FromGame(session.game,session.description))
+
+    # An event that can be sent to the workers. The manager ignores Ctrl+C, so that it outlives the games that are archived then.
+    def cancel_event(self):
+        if self.manager is None:
+            self.manager = SyncManager()
+            self.manager.start(signal.signal,(signal.SIGINT,signal.SIG_IGN))
+        return self.manager.Event()
+
+    def close(self):
+        if self.manager is not None:
+            self.manager.shutdown()
+            self.manager = None
+
+    # Removes the games that have been idle for too long
+    def evict(self,now=None):
+        if now is None:
+            now = monotonic()
+        expired = [
+            key for key,session in self.sessions.items()
+            if now-session.last_used > (self.ended_ttl if session.game.ended else self.ttl) and session.search is None
+        ]
+        for key in expired:
+            self.remove(key)
+        self.evicted += len(expired)
+        if self.archive is not None:
+            self.archive.flush()
+        return len(expired)
+
+class HTTPError(Exception):
+    def __init__(self,status,message):
+        super().__init__(message)
+        self.status = status
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict', 500: 'Internal Server Error'}
+
+class GameServer:
+    '''
+        Serves the games of a GameStore. The bots search in a pool of worker processes, so the event loop only
+        handles requests and applies moves.
+    '''
+    def __init__(self,store,workers=None):
+        self.store = store
+        self.workers = workers
+        self.pool = None
+        self.tasks = set()
+        self.moves = 0
+        self.start_time = monotonic()
+
+    async def play_bots(self,session):
+        loop = asyncio.get_running_loop()
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers)
+        while session.key in self.store and session.bot_to_move():
+            session.search = asyncio.ensure_future(loop.run_in_executor(self.pool,*session.bot_search()))
+            try:
+                move = await session.search
+            except asyncio.CancelledError:
+                return
+            except Exception:
+                move = 'pass'
+            finally:
+                session.search = None
+            if self.store.sessions.get(session.key) is not session:
+                return
+            try:
+                session.game.process_move(move)
+            except Exception:
+                # A bot that plays an illegal move passes instead
+                session.game.process_move('pass')
+            self.moves += 1
+
+    # Plays the bots of a game in which no person plays in the background
+    def play_in_background(self,session):
+        task = asyncio.ensure_future(self.play_bots(session))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def get_session(self,key):
+        try:
+            return self.store.get(key)
+        except Exception as e:
+            raise HTTPError(404,str(e))
+
+    async def route(self,method,path,body):
+        path,_,query = path.partition('?')
+        query = {name: values[-1] for name,values in parse_qs(query).items()}
+        parts = [part for part in path.split('/') if part]
+        if parts==['stats'] and method=='GET':
+            return {
+                'games': len(self.store),
+                'evicted': self.store.evicted,
+                'thinking': sum(session.search is not None for session in self.store.sessions.values()),
+                'moves': self.moves,
+                'moves_per_second': self.moves/(monotonic()-self.start_time),
+            }
+        if parts==['games'] and method=='POST':
+            try:
+                session = self.store.create(body['board'],body.get('black',"you"),body.get('white',"you"),body.get('komi',3.5))
+            except Exception as e:
+                raise HTTPError(400,str(e))
+            if len(session.bots)==2:
+                self.play_in_background(session)
+            else:
+                await self.play_bots(session)
+            return session.info()
+        if len(parts)<2 or parts[0]!='games':
+            raise HTTPError(404,f"Unknown path {path}")
+        session = self.get_session(parts[1])
+        if len(parts)==2 and method=='GET':
+            return session.info(int(query['since']) if 'since' in query else None)
+        if len(parts)==2 and method=='DELETE':
+            self.store.remove(session.key)
+            return {'key': session.key}
+        if parts[2:]==['graph'] and method=='GET':
+            return session.graph(query.get('binary','0') not in ('0',''))
+        if parts[2:]==['moves'] and method=='POST':
+            if session.bot_to_move():
+                raise HTTPError(409,"Wait for the bot to move.")
+            try:
+                session.game.process_move(body['move'])
+            except Exception as e:
+                raise HTTPError(400,str(e))
+            self.moves += 1
+            await self.play_bots(session)
+            return session.info(body.get('since'))
+        raise HTTPError(405,f"{method} {path} is not supported")
+
+    async def handle(self,reader,writer):
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                method,path,_ = request.decode('latin-1').split(' ',2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n',b'\n',b''):
+                        break
+                    name,_,value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length',0))
+                data = await reader.readexactly(length) if length else b''
+                try:
+                    status,response = 200,await self.route(method,path,json.loads(data) if data else {})
+                except HTTPError as e:
+                    status,response = e.status,{'error': str(e)}
+                except Exception as e:
+                    status,response = 400 if isinstance(e,(KeyError,ValueError)) else 500,{'error': str(e)}
+                payload = json.dumps(response).encode()
+                writer.write(
+                    f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n'
+                    f'Content-Length: {len(payload)}\r\n\r\n'.encode()+payload
+                )
+                await writer.drain()
+                if headers.get('connection','').lower()=='close':
+                    break
+        except (ConnectionError,asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def evict_periodically(self,interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.store.evict()
+
+    async def serve(self,host='127.0.0.1',port=8765,ready=None):
+        server = await asyncio.start_server(self.handle,host,port)
+        evictor = asyncio.ensure_future(self.evict_periodically(max(1,min(self.store.ttl,self.store.ended_ttl)/10)))
+        if ready is not None:
+            ready.set_result(server.sockets[0].getsockname()[1])
+        serving = asyncio.ensure_future(server.serve_forever())
+        # SIGTERM stops serving like Ctrl+C, so that the workers are shut down and the archive is closed
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM,serving.cancel)
+        except NotImplementedError:
+            pass
+        try:
+            async with server:
+                await serving
+        except asyncio.CancelledError:
+            pass
+        finally:
+            try:
+                loop.remove_signal_handler(signal.SIGTERM)
+            except NotImplementedError:
+                pass
+            evictor.cancel()
+            if self.pool is not None:
+                self.pool.shutdown(cancel_futures=True)
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Serves many games at once over HTTP, without the GUI.')
+    parser.add_argument('--host',default='127.0.0.1')
+    parser.add_argument('--port',type=int,default=8765)
+    parser.add_argument('--workers',type=int,default=None,help='processes in which the bots search (default one per CPU)')
+    parser.add_argument('--max-games',type=int,default=1000)
+    parser.add_argument('--ttl',type=float,default=3600,help='seconds after which an idle game is removed')
+    parser.add_argument('--ended-ttl',type=float,default=300,help='seconds after which an idle game that has ended is removed')
+    parser.add_argument('--max-nodes',type=int,default=10000,help='game nodes that a game keeps at most')
+    parser.add_argument('--table-mb',type=float,default=16,help='size of the transposition table of each bot')
+    parser.add_argument('--archive',default=None,help='file to which the records of the games are appended when they are removed')
+    parser.add_argument('--book',default=None,help='opening book of the bots (see book.py)')
+    args = parser.parse_args()
+
+    archive = None if args.archive is None else RecordWriter.Open(args.archive)
+    book = None if args.book is None else OpeningBook.Open(args.book)
+    store = GameStore(args.max_games,args.ttl,args.ended_ttl,args.max_nodes,args.table_mb,archive=archive,book=book)
+    print(f'Serving on http://{args.host}:{args.port}')
+    try:
+        asyncio.run(GameServer(store,args.workers).serve(args.host,args.port))
+    finally:
+        if archive is not None:
+            # The games that are still being played are archived as well
+            for key in list(store.sessions):
+                store.remove(key)
+            archive.close()
+        store.close()
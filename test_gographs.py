@@ -0,0 +1,83 @@
+import contextlib
+import io
+import random
+import numpy as np
+import pytest
+import networks as nets
+from gographs import GoGame,BLACK,WHITE,EMPTY,compute_territory
+
+'''
+    Checks of the incremental indexes of the game against a computation from scratch, on random games.
+    Run with `python -m pytest`.
+'''
+
+BOARDS = {
+    'GRID 5 5': lambda: nets.generate_grid(5,5),
+    'GRID 9 9': lambda: nets.generate_grid(9,9),
+    'USA': nets.usa_network,
+    'DODECAHEDRAL': nets.dodecahedral_graph,
+    'REGULAR 20 3': lambda: nets.generate_board('REGULAR 20 3',seed=0),
+}
+
+# Yields the game after every legal move of random games, with the move, the board and the captures before it
+def random_positions(name,games=4,seed=0):
+    G,pos = BOARDS[name]()
+    n = len(G)
+    rng = random.Random(seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(games):
+            game = GoGame(G,pos=pos,prune=True)
+            for _ in range(8*n):
+                before = game.board.copy()
+                captures = dict(game.captures)
+                move = rng.randrange(n) if rng.random()>0.002 else 'pass'
+                try:
+                    game.process_move(move)
+                except Exception:
+                    continue
+                if game.ended:
+                    break
+                yield game,move,before,captures
+
+@pytest.mark.parametrize('name',list(BOARDS))
+def test_group_index(name):
+    for game,move,before,captures in random_positions(name):
+        board = game.board
+        # The group graph is the reference: its groups are the connected components of each color
+        groups = game.group_graph()
+        for _,data in groups.nodes(data=True):
+            if data['status']==EMPTY:
+                continue
+            stones = set(data['ids'])
+            liberties = {j for i in stones for j in game.graph.neighbors[i] if board[j]==EMPTY}
+            for i in stones:
+                assert game.groups.group(i)==stones,(name,game.moves)
+                assert game.groups.group_liberties(i)==liberties,(name,game.moves)
+                assert game.groups.color[game.groups.find(i)]==data['status']
+        for i in np.flatnonzero(board==EMPTY):
+            assert game.groups.find(i) is None
+        # The same groups as the batch computation of the groups
+        batch = game.graph.batch_groups(board[None])
+        stone_groups = sum(1 for _,data in groups.nodes(data=True) if data['status']!=EMPTY)
+        assert int((batch.status!=EMPTY).sum())==stone_groups
+        # The captured stones are the enemy groups without liberties after the stone is placed
+        if move!='pass':
+            color = board[move]
+            placed = before.copy()
+            placed[move] = color
+            batch = game.graph.batch_groups(placed[None])
+            dead = np.flatnonzero((batch.status==1-color) & (batch.liberty_edges==0))
+            expected = np.flatnonzero(np.isin(batch.labels,dead))
+            assert np.array_equal(np.flatnonzero((before!=EMPTY) & (board==EMPTY)),expected),(name,game.moves)
+            assert game.captures[color]-captures[color]==len(expected)
+
+# The territory that the game keeps up to date is the territory computed from scratch with the group graph
+@pytest.mark.parametrize('name',list(BOARDS))
+def test_territory_index(name):
+    for game,_,_,_ in random_positions(name):
+        expected = compute_territory(game.group_graph())
+        assert game.territory.territory==expected,(name,game.moves,game.territory.territory,expected)
+        score = game.compute_score()
+        assert score[BLACK]-game.captures[BLACK]==expected[BLACK]
+        assert score[WHITE]-game.captures[WHITE]-game.komi==expected[WHITE]
+        assert sum(map(len,game.territory.members.values()))==int((game.board==EMPTY).sum())
@@ -0,0 +1,235 @@
+import argparse
+import contextlib
+import io
+import itertools as it
+import json
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor,as_completed
+from time import perf_counter
+import numpy as np
+import networks as nets
+from gographs import GoGame,BLACK,WHITE
+from bots import make_bot
+from records import GameRecord,RecordWriter
+from book import OpeningBook
+
+board_cache = nets.BoardCache()
+
+'''
+    Headless tournaments between bots. Every game is played in a worker process, and the results are written to a
+    file with one JSON object per line as soon as they come in. Run `python tournament.py --help` for the options.
+'''
+
+'''
+    Plays one game and returns its result. The random boards and the bots are seeded with seed, so that a game can
+    be replayed. The boards are kept in the board cache. The output of the game and the bots is discarded.
+    With record, the result has the GameRecord of the game as well. The bots look up the opening in book, if it is given.
+'''
+def play_game(game_id,board,black,white,seed,komi=3.5,max_moves=None,record=False,book=None):
+    start = perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        graph,names,pos = board_cache.load(board,seed)
+        random.seed(seed)
+        np.random.seed(seed)
+        game = GoGame(graph,komi=komi,pos=pos,names=names,prune=True)
+        players = {BLACK: black, WHITE: white}
+        # The bots get different seeds, so that the same bots don't play the same moves
+        bots = {color: make_bot(players[color],game,book=book,seed=2*seed+color) for color in players}
+        if max_moves is None:
+            max_moves = 4*graph.n
+        thinking = {BLACK: 0.0, WHITE: 0.0}
+        moves = {BLACK: 0, WHITE: 0}
+        while not game.ended and len(game.moves)<max_moves:
+            color = game.turn
+            move_start = perf_counter()
+            move = bots[color].choose_move(game.gamenode)
+            thinking[color] += perf_counter()-move_start
+            moves[color] += 1
+            try:
+                game.process_move(move)
+            except Exception:
+                # A bot that plays an illegal move passes instead
+                game.process_move('pass')
+        scores = game.final_score if game.ended else game.compute_score()
+        for bot in bots.values():
+            if hasattr(bot,'close'):
+                bot.close()
+    margin = scores[BLACK]-scores[WHITE]
+    result = {
+        'id': game_id,
+        'board': board,
+        'black': black,
+        'white': white,
+        'seed': seed,
+        'winner': 'black' if margin>0 else 'white' if margin<0 else 'draw',
+        'margin': margin,
+        'moves': len(game.moves),
+        'ended': game.ended,
+        'black_time_per_move': thinking[BLACK]/max(moves[BLACK],1),
+        'white_time_per_move': thinking[WHITE]/max(moves[WHITE],1),
+        'seconds': perf_counter()-start,
+    }
+    if record:
+        result['record'] = GameRecord.FromGame(game,{'id': game_id, 'board': board, 'black': black, 'white': white, 'seed': seed})
+    return result
+
+# All games of a round robin: every pair of players plays games_per_pair games on every board, alternating colors
+def schedule(players,boards,games_per_pair,seed=0):
+    games = []
+    for board in boards:
+        for first,second in it.combinations(players,2):
+            for k in range(games_per_pair):
+                black,white = (first,second) if k%2==0 else (second,first)
+                games.append((len(games),board,black,white,seed+len(games)))
+    return games
+
+'''
+    Plays the games on a pool of workers and writes each result to out (a file object) when it is finished, and the
+    record of each game to records (a RecordWriter) if it is given.
+    Returns the results and the number of games per hour.
+'''
+def run(games,workers=None,out=None,komi=3.5,max_moves=None,verbose=True,records=None,book=None):
+    results = []
+    start = perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(play_game,*game,komi=komi,max_moves=max_moves,record=records is not None,book=book) for game in games]
+        for future in as_completed(futures):
+            result = future.result()
+            record = result.pop('record',None)
+            if record is not None:
+                records.write(record)
+                records.flush()
+            results.append(result)
+            if out is not None:
+                out.write(json.dumps(result)+'\n')
+                out.flush()
+            if verbose:
+                print(f"{len(results)}/{len(games)} {result['board']}: {result['black']} (black) vs "
+                      f"{result['white']} (white), {result['winner']} wins by {abs(result['margin'])}")
+    return results,3600*len(games)/(perf_counter()-start)
+
+def read_results(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+# The score of the player with black in a game: 1 for a win, 0.5 for a draw and 0 for a loss
+def black_score(result):
+    return {'black': 1.0, 'draw': 0.5, 'white': 0.0}[result['winner']]
+
+# Wilson score interval of a win rate of wins out of n games, at the confidence level of z standard deviations
+def wilson_interval(wins,n,z=1.96):
+    if n==0:
+        return 0.0,1.0
+    p = wins/n
+    center = (p+z*z/(2*n))/(1+z*z/n)
+    half = z*math.sqrt(p*(1-p)/n+z*z/(4*n*n))/(1+z*z/n)
+    return max(center-half,0.0),min(center+half,1.0)
+
+# The Elo difference that corresponds to the expected score p
+def elo_difference(p):
+    p = min(max(p,1e-6),1-1e-6)
+    return -400*math.log10(1/p-1)
+
+'''
+    Elo ratings of the players by maximum likelihood (Bradley-Terry, with the MM algorithm), where draws count as half a
+    win for both.
+    The ratings are shifted so that their mean is 0.
+'''
+def elo_ratings(results,players,iterations=200):
+    wins = {player: 0.0 for player in players}
+    games = {pair: 0 for pair in it.permutations(players,2)}
+    for result in results:
+        score = black_score(result)
+        wins[result['black']] += score
+        wins[result['white']] += 1-score
+        games[result['black'],result['white']] += 1
+    strength = {player: 1.0 for player in players}
+    for _ in range(iterations):
+        for player in players:
+            denominator = sum(
+                (games[player,other]+games[other,player])/(strength[player]+strength[other])
+                for other in players if other!=player
+            )
+            # A virtual draw against a player of strength 1 keeps players that win or lose all games from getting infinite ratings
+            strength[player] = (wins[player]+0.5)/(denominator+1/(strength[player]+1))
+    mean = sum(math.log10(s) for s in strength.values())/len(players)
+    return {player: 400*(math.log10(s)-mean) for player,s in strength.items()}
+
+'''
+    Prints the win rate of every pair of players with a 95% confidence interval and the corresponding Elo difference,
+    and the Elo rating of every player with a 95% confidence interval from bootstrapping the games.
+'''
+def summarize(results,bootstrap=200):
+    players = sorted({result['black'] for result in results}|{result['white'] for result in results})
+    print(f'{len(results)} games')
+    for first,second in it.combinations(players,2):
+        scores = [
+            black_score(result) if result['black']==first else 1-black_score(result)
+            for result in results
+            if {result['black'],result['white']}=={first,second}
+        ]
+        if not scores:
+            continue
+        low,high = wilson_interval(sum(scores),len(scores))
+        p = sum(scores)/len(scores)
+        print(f'{first} vs {second}: {len(scores)} games, score {p:.3f} [{low:.3f}, {high:.3f}], '
+              f'Elo {elo_difference(p):+.0f} [{elo_difference(low):+.0f}, {elo_difference(high):+.0f}]')
+    ratings = elo_ratings(results,players)
+    rng = random.Random(0)
+    samples = {player: [] for player in players}
+    for _ in range(bootstrap):
+        sample = [rng.choice(results) for _ in results]
+        for player,rating in elo_ratings(sample,players,iterations=50).items():
+            samples[player].append(rating)
+    for player in sorted(players,key=ratings.get,reverse=True):
+        ordered = sorted(samples[player])
+        low,high = ordered[int(0.025*bootstrap)],ordered[int(0.975*bootstrap)-1]
+        moves = [
+            result[f'{color}_time_per_move']
+            for result in results
+            for color in ['black','white']
+            if result[color]==player
+        ]
+        print(f'{player:20} Elo {ratings[player]:+6.0f} [{low:+6.0f}, {high:+6.0f}], '
+              f'{1000*sum(moves)/len(moves):7.1f}ms per move')
+
+# Games per hour for an increasing number of workers, on the same games
+def scaling(games,max_workers=None,komi=3.5,max_moves=None):
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    workers = 1
+    while workers<=max_workers:
+        _,games_per_hour = run(games,workers=workers,komi=komi,max_moves=max_moves,verbose=False)
+        print(f'{workers:3} workers: {games_per_hour:8.0f} games/hour')
+        workers *= 2
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Plays a round robin tournament between bots.')
+    parser.add_argument('--players',nargs='+',default=['AlphaBeta 2','MiniMax 2','MCTS 500'],
+                        help='bot descriptions as accepted by bots.make_bot')
+    parser.add_argument('--boards',nargs='+',default=nets.BOARD_NAMES,help='board names as accepted by networks.generate_board')
+    parser.add_argument('--games',type=int,default=2,help='games per pair of players on each board')
+    parser.add_argument('--workers',type=int,default=None)
+    parser.add_argument('--komi',type=float,default=3.5)
+    parser.add_argument('--max-moves',type=int,default=None,help='moves after which a game is scored (default 4 times the board size)')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--out',default='results.jsonl',help='file to which the results are appended')
+    parser.add_argument('--records',default=None,help='file to which the records of the games are appended (see records.py)')
+    parser.add_argument('--book',default=None,help='opening book of the bots (see book.py)')
+    parser.add_argument('--summary',action='store_true',help='only summarize the results in --out')
+    parser.add_argument('--scaling',action='store_true',help='report games/hour for an increasing number of workers')
+    args = parser.parse_args()
+
+    games = schedule(args.players,args.boards,args.games,seed=args.seed)
+    if args.scaling:
+        scaling(games,args.workers,komi=args.komi,max_moves=args.max_moves)
+    else:
+        if not args.summary:
+            with open(args.out,'a') as out,contextlib.ExitStack() as stack:
+                records = None if args.records is None else stack.enter_context(RecordWriter.Open(args.records))
+                book = None if args.book is None else OpeningBook.Open(args.book)
+                _,games_per_hour = run(games,workers=args.workers,out=out,komi=args.komi,max_moves=args.max_moves,records=records,book=book)
+            print(f'{games_per_hour:.0f} games/hour')
+        summarize(read_results(args.out))
@@ -1,4 +1,5 @@
 var game_key,state,graph,animation;
+var version; // The version of the board that is shown
 var gameMode = "GRID 5 5";
 var blackPlayer = "you";
 var whitePlayer = "MiniMax 3";
@@ -56,6 +57,10 @@ function start_game() {
     blackPlayer = document.getElementById("black-dropdown").value;
     whitePlayer = document.getElementById("white-dropdown").value;
     document.getElementById('container').innerHTML = '';
+    if (game_key!==undefined) {
+      // Stops the bots of the previous game
+      eel.abandon_game(game_key);
+    }
     eel.start_game(graphType,blackPlayer,whitePlayer);
 }
 
@@ -76,10 +81,17 @@ function updateGui(info) {
   if (info.key!=game_key) {
     // Initialize
     game_key = info.key;
+    version = undefined;
     //graph = await eel.get_graph(game_key)();
     //animation = chart();
     //document.getElementById('container').appendChild(animation.svg);
   }
+  if (info.state===undefined && info.since!==version) {
+    // The changes don't follow the board that is shown, so we ask for the whole board
+    eel.get_info(game_key)(updateGui);
+    return;
+  }
+  version = info.version;
   animation.update(info);
   if (info.ended) {
     var win = info.score[BLACK]>info.score[WHITE] ? BLACK : WHITE;
@@ -88,14 +100,30 @@ function updateGui(info) {
     document.getElementById('status-label').innerHTML = names[win]+' won with '+dif+' points (Black: '+info.score[BLACK]+', White: '+info.score[WHITE]+')'
     document.getElementById('score-label').innerHTML = '';
   } else {
-    document.getElementById('status-label').innerHTML = names[info.turn]+"'s turn.";
-    document.getElementById('score-label').innerHTML = 'Black: '+info.captures[BLACK]+' captures, White: '+info.captures[WHITE]+' captures + '+info.komi+' komi.';
+    document.getElementById('status-label').innerHTML = names[info.turn]+"'s turn"+(info.thinking ? ' (thinking...)' : '.');
+    document.getElementById('score-label').innerHTML = 'Black: '+info.territory[BLACK]+' territory + '+info.captures[BLACK]+' captures, White: '+info.territory[WHITE]+' territory + '+info.captures[WHITE]+' captures + '+info.komi+' komi.';
   }
 }
 eel.expose(updateGui);
 
+// The typed array with the bytes of a base64 string
+function unpack(data,type) {
+  const bytes = Uint8Array.from(atob(data), c => c.charCodeAt(0));
+  return new type(bytes.buffer);
+}
+
+// A graph that was sent as packed arrays, with the positions and edges as lists of pairs
+function decodeGraph(packed) {
+  const pos = unpack(packed.pos,Float32Array);
+  const edges = unpack(packed.edges,packed.edge_type=='uint16' ? Uint16Array : Int32Array);
+  return {
+    'pos': Array.from({length: pos.length/2}, (_,i) => [pos[2*i],pos[2*i+1]]),
+    'edges': Array.from({length: edges.length/2}, (_,i) => [edges[2*i],edges[2*i+1]])
+  };
+}
+
 function setGraph(newgraph) {
-  graph = newgraph;
+  graph = newgraph.binary ? decodeGraph(newgraph) : newgraph;
   animation = chart();
   document.getElementById('container').appendChild(animation.svg);
 }
@@ -207,12 +235,31 @@ function chart() {
       //event.subject.fy = null;
     }
 
+    // The board that is shown, and the circle of each place
+    const board = new Int8Array(nodes.length).fill(EMPTY);
+    const circles = node.nodes();
+
+    function show(i) {
+      d3.select(circles[i])
+        .classed('empty', board[i]==EMPTY)
+        .classed('black', board[i]==BLACK)
+        .classed('white', board[i]==WHITE);
+    }
+
+    // Shows the whole board (info.state) or only the places that changed (info.changes, pairs of place and status)
     function update(info) {
-      console.log(info);
-      newstate = info['state'];
-      node.classed('empty', v=>(newstate[v.id]==EMPTY));
-      node.classed('black', v=>(newstate[v.id]==BLACK));
-      node.classed('white', v=>(newstate[v.id]==WHITE));
+      if (info.state!==undefined) {
+        board.set(info.state);
+        for (let i=0; i<board.length; i++) {
+          show(i);
+        }
+      } else {
+        const changes = info.changes;
+        for (let k=0; k<changes.length; k+=2) {
+          board[changes[k]] = changes[k+1];
+          show(changes[k]);
+        }
+      }
     }
 
     return {